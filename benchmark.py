@@ -0,0 +1,241 @@
+#!/usr/bin/python3
+'''
+The goal of this script is to time and memory-profile every stage of the pipeline on synthetic
+data from synthetic_data.py, so that speedups and regressions can be tracked offline.
+Each stage runs in a fresh interpreter: its inputs are loaded first, then only the stage itself
+is timed. The JSON result lists per stage the wall time of each run, the CPU time of the stage
+and of its worker processes, and the peak RSS before and during the stage.
+Run with the parameters of synthetic_data.py, e.g. --scale 10 for a 10x conference; the data is
+generated into the data directory unless it already holds data with the same parameters.
+'''
+import contextlib
+from datetime import datetime
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import shutil
+import sys
+import time
+
+import instrument
+import synthetic_data
+
+RESULT_VERSION = 1
+
+class Data():
+    # paths of the synthetic inputs and of files derived from them
+    def __init__(self, data_dir):
+        self.dir = data_dir
+        self.dblp = os.path.join(data_dir, 'dblp.xml.gz')
+        self.users = os.path.join(data_dir, 'hotcrp-users.csv')
+        self.mapped = os.path.join(data_dir, 'hotcrp-users-mapped.csv')
+        self.store = os.path.join(data_dir, 'hotcrp-users-mapped.db')
+        self.authors = os.path.join(data_dir, 'hotcrp-authors.csv')
+        self.scores = os.path.join(data_dir, 'hotcrp-scores.csv')
+        self.allprefs = os.path.join(data_dir, 'hotcrp-allprefs.csv')
+        self.manifest = os.path.join(data_dir, 'manifest.csv')
+        self.index = os.path.join(data_dir, 'dblp-index')
+
+def coauthor_store(data, workers):
+    # the conflict checks need the store that find_coauthors.py writes
+    from coauthor_store import write_store
+    import find_coauthors
+    if not os.path.exists(data.store):
+        reviewers = find_coauthors.load_reviewers(data.mapped)
+        state = find_coauthors.parse_dblp(data.dblp, reviewers, workers)
+        write_store(data.store, reviewers.values(), datetime.now().year, find_coauthors.store_aliases(reviewers, find_coauthors.state_aliases(state)))
+    return data.store
+
+# each stage loads its inputs and returns the function to time
+
+def stage_dblp_index(data, workers):
+    import dblp_index
+    return lambda: dblp_index.build_index(data.dblp, data.index, workers)
+
+def stage_match_reviewers(data, workers):
+    import match_reviewers_dblp
+    reviewers = match_reviewers_dblp.get_reviewers(data.users)
+    return lambda: match_reviewers_dblp.parse_dblp(data.dblp, reviewers, workers)
+
+def stage_find_coauthors(data, workers):
+    import find_coauthors
+    reviewers = find_coauthors.load_reviewers(data.mapped)
+    return lambda: find_coauthors.parse_dblp(data.dblp, reviewers, workers)
+
+def stage_check_reviews(data, workers):
+    import check_reviews
+    from coauthor_store import CoauthorStore
+    store = CoauthorStore(coauthor_store(data, workers))
+    papers = check_reviews.get_papers(data.authors, store.aliases())
+    return lambda: check_reviews.check_conflicts(data.scores, papers, store)
+
+def stage_conflict_matrix(data, workers):
+    import check_reviews
+    import conflict_matrix
+    from coauthor_store import CoauthorStore, index_reviewers
+    store = CoauthorStore(coauthor_store(data, workers))
+    papers = check_reviews.get_papers(data.authors, store.aliases())
+    return lambda: conflict_matrix.conflict_matrix(papers, index_reviewers(store), store.year)
+
+def stage_check_identities(data, workers):
+    import check_identities
+    from coauthor_store import CoauthorStore
+    import dblp_index
+    if not os.path.exists(os.path.join(data.index, 'meta.json')):
+        dblp_index.build_index(data.dblp, data.index, workers)
+    identities, coauthors = check_identities.index_identities(CoauthorStore(coauthor_store(data, workers)), data.authors, data.index)
+    return lambda: check_identities.similar_identities(identities, coauthors)
+
+def stage_read_prefs(data, workers):
+    import check_bidding
+    paper_authors, papers_per_author = check_bidding.read_papers(data.authors)
+    return lambda: check_bidding.read_prefs(data.allprefs, paper_authors)
+
+def stage_bidding_report(data, workers):
+    import check_bidding
+    paper_authors, papers_per_author = check_bidding.read_papers(data.authors)
+    reviewers = check_bidding.read_prefs(data.allprefs, paper_authors)
+    def report():
+        for reviewer in sorted(reviewers):
+            reviewers[reviewer].report(len(paper_authors), papers_per_author)
+    return report
+
+def stage_load_bids(data, workers):
+    import check_bidding
+    return lambda: check_bidding.load_bids(data.allprefs)
+
+def stage_batch_report(data, workers):
+    import check_bidding
+    paper_authors, papers_per_author = check_bidding.read_papers(data.authors)
+    bids = check_bidding.load_bids(data.allprefs)
+    return lambda: check_bidding.batch_report(bids, paper_authors, papers_per_author)
+
+def stage_check_rings(data, workers):
+    import check_bidding
+    import check_rings
+    paper_emails = check_rings.read_paper_emails(data.authors)
+    bids = check_bidding.load_bids(data.allprefs)
+    def rings():
+        graph = check_rings.reviewer_graph(bids, paper_emails)
+        return check_rings.reciprocal_pairs(graph), check_rings.bidding_cycles(graph), check_rings.dense_groups(graph)
+    return rings
+
+def stage_compute_bai(data, workers):
+    import compute_bai
+    return lambda: compute_bai.load_manifest(data.manifest, workers).gen_report()
+
+STAGES = {
+    'dblp_index': stage_dblp_index,
+    'match_reviewers': stage_match_reviewers,
+    'find_coauthors': stage_find_coauthors,
+    'check_reviews': stage_check_reviews,
+    'conflict_matrix': stage_conflict_matrix,
+    'check_identities': stage_check_identities,
+    'read_prefs': stage_read_prefs,
+    'bidding_report': stage_bidding_report,
+    'load_bids': stage_load_bids,
+    'batch_report': stage_batch_report,
+    'check_rings': stage_check_rings,
+    'compute_bai': stage_compute_bai,
+}
+
+def measure(name, data_dir, workers, results):
+    # runs in a fresh process, output of the scripts is discarded
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            timed = STAGES[name](Data(data_dir), workers)
+            setup_rss = instrument.peak_rss_mb()
+            before = resource.getrusage(resource.RUSAGE_SELF)
+            before_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            start = time.perf_counter()
+            timed()
+            wall = time.perf_counter() - start
+            after = resource.getrusage(resource.RUSAGE_SELF)
+            after_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    except Exception as e:
+        # report the failure instead of leaving the parent waiting
+        results.put({'error': '{}: {}'.format(type(e).__name__, e)})
+        raise
+    results.put({'wall': wall,
+                 'cpu': after.ru_utime + after.ru_stime - before.ru_utime - before.ru_stime,
+                 'children_cpu': max(0.0, after_children.ru_utime + after_children.ru_stime - before_children.ru_utime - before_children.ru_stime),
+                 'setup_rss_mb': setup_rss, 'peak_rss_mb': instrument.peak_rss_mb(),
+                 'children_peak_rss_mb': instrument.peak_rss_mb(resource.RUSAGE_CHILDREN)})
+
+def run_stage(name, data_dir, workers):
+    # not a Pool: stages with workers > 1 start their own pool, which daemonic processes cannot
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=measure, args=(name, data_dir, workers, results))
+    process.start()
+    # a stage killed e.g. by the OOM killer never puts its result
+    while True:
+        exited = process.exitcode != None
+        try:
+            result = results.get(timeout=1)
+            break
+        except queue.Empty:
+            if exited:
+                result = {'error': 'stage process exited with code {}'.format(process.exitcode)}
+                break
+    process.join()
+    return result
+
+def prepare(data_dir, params):
+    # reuse existing data only if it was generated with the same parameters
+    summary_file = os.path.join(data_dir, 'synthetic.json')
+    if os.path.exists(summary_file):
+        with open(summary_file) as f:
+            summary = json.load(f)
+        if summary['params'] == params:
+            return summary
+    # the stages reuse what they derived from the inputs, which is stale for the new data
+    data = Data(data_dir)
+    for derived in (data.store, data.mapped[:-4]+'-refresh.pickle'):
+        if os.path.exists(derived):
+            os.remove(derived)
+    if os.path.exists(data.index):
+        shutil.rmtree(data.index)
+    start = time.perf_counter()
+    summary = synthetic_data.generate(data_dir, params)
+    print('Generated synthetic data in {:.1f}s'.format(time.perf_counter() - start))
+    return summary
+
+def benchmark(data_dir, params, stages, workers, repeat):
+    summary = prepare(data_dir, params)
+    data = Data(data_dir)
+    results = {'version': RESULT_VERSION, 'created': datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+               'workers': workers, 'data': summary,
+               'inputs': {os.path.basename(path): os.path.getsize(path) for path in (data.dblp, data.users, data.authors, data.scores, data.allprefs)},
+               'stages': {}}
+    for name in stages:
+        runs = [run_stage(name, data_dir, workers) for i in range(repeat)]
+        if any('error' in run for run in runs):
+            results['stages'][name] = {'error': [run['error'] for run in runs if 'error' in run][0]}
+            print('{:16} failed: {}'.format(name, results['stages'][name]['error']))
+            continue
+        best = min(runs, key=lambda run: run['wall'])
+        stage = dict(best)
+        stage['wall'] = [run['wall'] for run in runs]
+        stage['peak_rss_mb'] = max(run['peak_rss_mb'] for run in runs)
+        results['stages'][name] = stage
+        print('{:16} {:8.2f}s wall {:8.2f}s cpu {:8.2f}s workers {:8.1f} MB peak ({:.1f} MB before the stage)'.format(
+            name, best['wall'], best['cpu'], best['children_cpu'], stage['peak_rss_mb'], best['setup_rss_mb']))
+    return results
+
+
+if __name__ == '__main__':
+    params = synthetic_data.scaled_params(sys.argv)
+    workers = instrument.pop_workers(sys.argv)
+    repeat = instrument.parse_number(instrument.pop_option(sys.argv, '--repeat', 1))
+    stages = (instrument.pop_option(sys.argv, '--stages', ','.join(STAGES)) or '').split(',')
+    if len(sys.argv) != 3 or params == None or workers < 1 or repeat == None or any(name not in STAGES for name in stages):
+        print('Benchmark the pipeline on synthetic data. Run the script with: python3 {} [--scale K] [synthetic_data.py options] [-j workers] [--repeat R] [--stages {}] data-dir results.json'.format(sys.argv[0], ','.join(STAGES)))
+        exit(1)
+    results = benchmark(sys.argv[1], params, stages, workers, repeat)
+    with open(sys.argv[2], 'w') as f:
+        json.dump(results, f, indent=1)
@@ -1,10 +1,13 @@
 #!/usr/bin/python3
 '''
 The goal of this script is to validate reviewer bidding
+With numpy and scipy all reviewers are checked at once, otherwise one after the other.
 '''
-import csv
 import sys
 
+from hotcrp import prefetch, read_columns, read_export
+import instrument
+
 POSITIVE_BID_MIN = 0.05 # we expect positive bids to at least % papers
 POSITIVE_AUTHOR_BIDS_RATIO_THRESHOLD = 0.20 # threshold of percentage of positive bids to a single author above which it becomes suspicious
 POSITIVE_AUTHOR_BIDS_THRESHOLD = 4 # report if more than X positive bids for the same author
@@ -71,60 +74,181 @@ class Reviewer:
 
 
 def read_papers(papers_csv):
-    with open(papers_csv, 'r') as f:
-        papers_csv = csv.reader(f)
-        paper_id = '0'
-        paper_authors = {}
-        authors = []
-        papers_per_author = {}
-        for row in papers_csv:
-            if row[0] == 'paper':
-                # validate data format
-                assert(row[1] == 'title' and row[2] == 'first' and row[3] == 'last' and row[4] == 'email')
-                continue
-            if paper_id != row[0]:
-                if paper_id != '0':
-                    # add one set of authors/paper
-                    paper_authors[paper_id] = authors
-                    authors = []
-                paper_id = row[0]
-            author = '{} {} <{}>'.format(row[2], row[3], row[4])
-            authors.append(author)
-            if author in papers_per_author:
-                papers_per_author[author] += 1
-            else:
-                papers_per_author[author] = 1
-        # add last authors to set
-        paper_authors[paper_id] = authors
+    paper_id = '0'
+    paper_authors = {}
+    authors = []
+    papers_per_author = {}
+    for paper, first, last, email in read_export(papers_csv, ('paper', 'first', 'last', 'email')):
+        if paper_id != paper:
+            if paper_id != '0':
+                # add one set of authors/paper
+                paper_authors[paper_id] = authors
+                authors = []
+            paper_id = paper
+        author = '{} {} <{}>'.format(first, last, email)
+        authors.append(author)
+        if author in papers_per_author:
+            papers_per_author[author] += 1
+        else:
+            papers_per_author[author] = 1
+    # add last authors to set
+    paper_authors[paper_id] = authors
     return paper_authors, papers_per_author
 
 def read_prefs(allprefs_csv, paper_authors):
-    with open(allprefs_csv, 'r') as f:
-        allprefs_csv = csv.reader(f)
-        reviewers = {}
-        for row in allprefs_csv:
-            if row[0] == 'paper':
-                # validate data format
-                assert(row[2] == 'given_name' and row[3] == 'family_name' and row[4] == 'email' and row[6] == 'preference' and row[7] == 'topic_score')
-                continue
-            name = '{} {}'.format(row[2], row[3])
-            email = row[4]
-            if not email in reviewers:
-                reviewers[email] = Reviewer(name, email)
-            preference = int(row[6]) if row[6] != '' else 0
-            topic_score = int(row[7]) if row[7] != '' else 0
-            reviewers[email].add_bid(paper_authors[row[0]], preference, topic_score)
+    reviewers = {}
+    for paper, given_name, family_name, email, preference, topic_score in read_export(allprefs_csv, ('paper', 'given_name', 'family_name', 'email', 'preference', 'topic_score'), ints=('preference', 'topic_score')):
+        if not email in reviewers:
+            reviewers[email] = Reviewer('{} {}'.format(given_name, family_name), email)
+        reviewers[email].add_bid(paper_authors[paper], preference, topic_score)
     return reviewers
 
 
 
+class BidMatrix:
+    # all bids of an allprefs export as arrays, rows keep the order of the CSV
+    def __init__(self, emails, names, papers, reviewer, paper, preference, topic_score):
+        self.emails = emails            # reviewer index -> email
+        self.names = names              # reviewer index -> name
+        self.papers = papers            # paper index -> paper id
+        self.reviewer = reviewer        # per bid: reviewer index
+        self.paper = paper              # per bid: paper index
+        self.preference = preference    # per bid: preference
+        self.topic_score = topic_score  # per bid: topic score
+        self._prefs = None
+
+    @property
+    def prefs(self):
+        # dense reviewer x paper preference matrix, HotCRP exports one row per pair
+        if self._prefs is None:
+            import numpy as np
+            self._prefs = np.zeros((len(self.emails), len(self.papers)), dtype=np.int64)
+            self._prefs[self.reviewer, self.paper] = self.preference
+        return self._prefs
+
+def have_numpy():
+    try:
+        import numpy
+        import scipy.sparse
+    except ImportError:
+        return False
+    return True
+
+def load_bids(allprefs_csv):
+    import numpy as np
+    columns = read_columns(allprefs_csv, ('paper', 'given_name', 'family_name', 'email', 'preference', 'topic_score'), ints=('preference', 'topic_score'))
+    reviewer, emails = columns['email']
+    paper, papers = columns['paper']
+    # name of each reviewer from their first row
+    given_names, family_names = columns['given_name'], columns['family_name']
+    first = np.unique(reviewer, return_index=True)[1]
+    names = ['{} {}'.format(given_names[1][given_names[0][i]], family_names[1][family_names[0][i]]) for i in first]
+    return BidMatrix(emails, names, papers, reviewer, paper, columns['preference'], columns['topic_score'])
+
+def author_bids(bids, rows, paper_authors, wanted):
+    # positive preferences per wanted author over the given bid rows in CSV order, like Reviewer.bids
+    lists = {}
+    for i in rows[bids.preference[rows] > 0]:
+        for author in paper_authors.get(bids.papers[bids.paper[i]], ()):
+            if author in wanted:
+                lists.setdefault(author, []).append(int(bids.preference[i]))
+    return lists
+
+def batch_report(bids, paper_authors, papers_per_author):
+    '''Same checks and output as Reviewer.report, computed for all reviewers at once.'''
+    import numpy as np
+    import scipy.sparse as sp
+    nr_papers = len(paper_authors)
+    nr_reviewers = len(bids.emails)
+    # author x paper incidence, an author listed twice on a paper counts twice like in Reviewer.add_bid
+    author_ids = {}
+    rows, cols = [], []
+    for p, paper_id in enumerate(bids.papers):
+        for author in paper_authors.get(paper_id, ()):
+            rows.append(author_ids.setdefault(author, len(author_ids)))
+            cols.append(p)
+    authors = list(author_ids)
+    incidence_t = sp.csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, cols)), shape=(len(authors), len(bids.papers))).T.tocsr()
+
+    prefs = bids.prefs
+    positive = prefs > 0
+    positive_bids = positive.sum(axis=1)
+    negpos_bids = np.bincount(bids.reviewer[(bids.preference > 0) & (bids.topic_score < 0)], minlength=nr_reviewers)
+    # number of positive bids per reviewer and author
+    counts = (sp.csr_matrix(positive.astype(np.int64)) @ incidence_t).tocoo()
+    heavy = (counts.data >= positive_bids[counts.row]*POSITIVE_AUTHOR_BIDS_RATIO_THRESHOLD) | (counts.data >= POSITIVE_AUTHOR_BIDS_THRESHOLD)
+
+    # BAI: only the top BAI_MAX_POSITIVE_BIDS bids count, and none below BAI_MIN_POSITIVE_SCORE
+    if BAI_MAX_POSITIVE_BIDS < 0:
+        kth = np.where(positive, prefs, np.iinfo(np.int64).max).min(axis=1, initial=np.iinfo(np.int64).max)
+        min_bid = np.where(positive_bids > 0, np.maximum(kth, BAI_MIN_POSITIVE_SCORE), BAI_MIN_POSITIVE_SCORE)
+    elif len(bids.papers) > BAI_MAX_POSITIVE_BIDS:
+        kth = -np.partition(-prefs, BAI_MAX_POSITIVE_BIDS, axis=1)[:, BAI_MAX_POSITIVE_BIDS]
+        min_bid = np.where(positive_bids > BAI_MAX_POSITIVE_BIDS, np.maximum(kth, BAI_MIN_POSITIVE_SCORE), BAI_MIN_POSITIVE_SCORE)
+    else:
+        min_bid = np.full(nr_reviewers, BAI_MIN_POSITIVE_SCORE)
+    sampled = positive & (prefs >= min_bid[:, None])
+    sampled_prefs = np.where(sampled, prefs, 0)
+    BX = sampled_prefs.sum(axis=1)
+    nr_sampled = sampled.sum(axis=1)
+    BXY = (sp.csr_matrix(sampled_prefs) @ incidence_t).tocoo()
+    nr_author_sampled = (sp.csr_matrix(sampled.astype(np.int64)) @ incidence_t).tocsr()
+    nr_author_sampled = np.asarray(nr_author_sampled[BXY.row, BXY.col]).ravel()
+    BAI = (BXY.data.astype(np.float64)/nr_author_sampled)/(BX[BXY.row].astype(np.float64)/nr_sampled[BXY.row])
+    affine = BAI > 2.0
+
+    # rows of each reviewer in CSV order, to list the preferences of flagged authors
+    by_reviewer = np.argsort(bids.reviewer, kind='stable')
+    segments = np.searchsorted(bids.reviewer[by_reviewer], np.arange(nr_reviewers+1))
+
+    # group the flagged reviewer/author pairs by reviewer
+    flagged = {}
+    for r, a in zip(counts.row[heavy], counts.col[heavy]):
+        flagged.setdefault(r, [set(), set()])[0].add(authors[a])
+    for r, a in zip(BXY.row[affine], BXY.col[affine]):
+        flagged.setdefault(r, [set(), set()])[1].add(authors[a])
+
+    for r in sorted(range(nr_reviewers), key=lambda r: bids.emails[r]):
+        resp = ''
+        if positive_bids[r] <= nr_papers*POSITIVE_BID_MIN:
+            resp += '- only {:.2f}% of bids were positive out of {} papers!\n'.format(int(positive_bids[r])/float(nr_papers)*100, nr_papers)
+        heavy_authors, affine_authors = flagged.get(r, [set(), set()])
+        lists = author_bids(bids, by_reviewer[segments[r]:segments[r+1]], paper_authors, heavy_authors | affine_authors) if r in flagged else {}
+        for author in lists:
+            if author in heavy_authors:
+                resp += '- {} of the positive bids went to {} ({})\n'.format(len(lists[author]), author, lists[author])
+        if nr_sampled[r] == 0:
+            resp += '- no positive bids remaining for BAI\n'
+        else:
+            for author in lists:
+                if author in affine_authors:
+                    pos_author_bids = [i for i in lists[author] if i >= min_bid[r]]
+                    BXY_author = sum(pos_author_bids)
+                    BAI_author = (float(BXY_author)/len(pos_author_bids))/(float(BX[r])/int(nr_sampled[r]))
+                    resp += '- bidding affinity is high for {}: {:.2f} {} BXY {} BX {} author papers {}\n'.format(author, BAI_author, pos_author_bids, BXY_author, int(BX[r]), papers_per_author[author])
+        if len(resp) != 0:
+            print('Reviewer {} <{}> has {} positive bids and {} positive bids with negative topic score'.format(bids.names[r], bids.emails[r], int(positive_bids[r]), int(negpos_bids[r])))
+            print(resp[:-1])
+
+
 if __name__ == '__main__':
+    timers = instrument.pop_profile(sys.argv)
     if len(sys.argv) != 3:
-        print('Check allpref data for bidding outliers. Run the script with: python3 {} hotcrp-authors.csv hotcrp-allprefs.csv'.format(sys.argv[0]))
+        print('Check allpref data for bidding outliers. Run the script with: python3 {} [--profile timings.json|stats.prof] hotcrp-authors.csv hotcrp-allprefs.csv'.format(sys.argv[0]))
         exit(1)
 
-    paper_authors, papers_per_author = read_papers(sys.argv[1])
-    reviewers = read_prefs(sys.argv[2], paper_authors)
-
-    for reviewer in sorted(reviewers):
-        reviewers[reviewer].report(len(paper_authors), papers_per_author)
+    with timers.stage('read papers'):
+        prefetch(sys.argv[1:3])
+        paper_authors, papers_per_author = read_papers(sys.argv[1])
+    if have_numpy():
+        with timers.stage('load bids'):
+            bids = load_bids(sys.argv[2])
+        with timers.stage('report'):
+            batch_report(bids, paper_authors, papers_per_author)
+    else:
+        with timers.stage('load bids'):
+            reviewers = read_prefs(sys.argv[2], paper_authors)
+        with timers.stage('report'):
+            for reviewer in sorted(reviewers):
+                reviewers[reviewer].report(len(paper_authors), papers_per_author)
+    timers.finish()
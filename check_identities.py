@@ -0,0 +1,197 @@
+#!/usr/bin/python3
+'''
+The goal of this script is to find duplicate identities: the same person under two PC or author
+accounts, or a reviewer whose coauthors are nearly the same as someone else's, which points to a
+hidden affiliation such as a shared group or a student. Identities are compared by the Jaccard
+similarity of their coauthor sets (shared coauthors / all coauthors of either).
+
+Comparing every pair is quadratic, so every coauthor set is summarized by a MinHash signature:
+NUM_HASHES random hash functions, each keeping the smallest hash over the set. Two signatures agree
+on a hash with probability equal to the Jaccard similarity of the sets. The signatures are cut into
+BANDS bands and only identities that agree on all hashes of at least one band become candidates
+(locality sensitive hashing). Candidates are then checked against the exact coauthor sets.
+Time and memory grow with the total size of the coauthor sets, not with the number of pairs.
+
+Without the DBLP index only the reviewers of the coauthor store are compared. With the index the
+submitting authors of the authors export are added, and everybody's coauthors come from the
+coauthor graph of the index over the same years as the store.
+'''
+import csv
+import json
+import sys
+
+import numpy as np
+
+from coauthor_store import CoauthorStore
+from hotcrp import prefetch, read_export
+import instrument
+
+NUM_HASHES = 120
+BANDS = 40 # 3 hashes per band: a pair with 0.5 Jaccard becomes a candidate with 99.5% probability
+MIN_JACCARD = 0.5
+MIN_COAUTHORS = 3 # a handful of coauthors says little about who someone is
+MAX_BUCKET = 500 # skip degenerate LSH buckets instead of comparing all their pairs
+PRIME = (1 << 31) - 1
+SEED = 1
+REPORT_FIELDS = ['jaccard', 'shared', 'name_a', 'email_a', 'dblp_a', 'role_a', 'coauthors_a', 'name_b', 'email_b', 'dblp_b', 'role_b', 'coauthors_b']
+
+class Identity():
+    def __init__(self, name, email, dblp, role):
+        self.name = name
+        self.email = email
+        self.dblp = dblp
+        self.role = role
+
+def store_identities(store):
+    # (identities, coauthor name sets) of all reviewers in the store
+    identities = []
+    coauthors = []
+    for reviewer in store.reviewers():
+        identities.append(Identity(reviewer.name, reviewer.email, reviewer.dblp, 'reviewer'))
+        coauthors.append(set(store.coauthor_years(reviewer)))
+    return identities, coauthors
+
+def index_identities(store, authors_csv, index_dir):
+    # reviewers and submitting authors, with coauthor id sets from the coauthor graph of the index
+    from dblp_index import DblpIndex
+    import transitive_conflicts
+    index = DblpIndex(index_dir)
+    adjacency = transitive_conflicts.window_adjacency(index, store.year)
+    identities = []
+    seen = set()
+    for reviewer in store.reviewers():
+        identities.append(Identity(reviewer.name, reviewer.email, reviewer.dblp, 'reviewer'))
+        seen.add(reviewer.email.lower())
+    # one identity per email, an author that is also on the PC is the same account
+    for first, last, email in read_export(authors_csv, ('first', 'last', 'email')):
+        key = email.lower() if email != '' else first+' '+last
+        if key not in seen:
+            seen.add(key)
+            identities.append(Identity(first+' '+last, email, first+' '+last, 'author'))
+    coauthors = []
+    for identity in identities:
+        aid = index.author_id(identity.dblp)
+        if aid == None:
+            coauthors.append(set())
+            continue
+        coauthors.append(set(adjacency.indices[adjacency.indptr[aid]:adjacency.indptr[aid+1]].tolist()))
+    return identities, coauthors
+
+def minhash_signatures(sets, num_hashes=NUM_HASHES, seed=SEED):
+    '''Returns a len(sets) x num_hashes array with the MinHash signature of each (non-empty) set.'''
+    universe = {}
+    ptr = np.zeros(len(sets)+1, dtype=np.int64)
+    elements = []
+    for i, members in enumerate(sets):
+        for member in members:
+            elements.append(universe.setdefault(member, len(universe)))
+        ptr[i+1] = len(elements)
+    elements = np.array(elements, dtype=np.int64)
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, PRIME, size=num_hashes, dtype=np.int64)
+    b = rng.integers(0, PRIME, size=num_hashes, dtype=np.int64)
+    signatures = np.empty((len(sets), num_hashes), dtype=np.int64)
+    if len(sets) == 0:
+        return signatures
+    # a few hash functions at a time keeps the hashed elements under ~64MB
+    step = max(1, (8 << 20) // max(1, len(elements)))
+    for start in range(0, num_hashes, step):
+        stop = min(num_hashes, start+step)
+        hashed = (a[start:stop, None] * elements[None, :] + b[start:stop, None]) % PRIME
+        signatures[:, start:stop] = np.minimum.reduceat(hashed, ptr[:-1], axis=1).T
+    return signatures
+
+def lsh_candidates(signatures, bands=BANDS, max_bucket=MAX_BUCKET):
+    '''Returns a sorted array of candidate pairs (i, j) with i < j, the identities whose signatures
+    agree on every hash of at least one band.'''
+    n, num_hashes = signatures.shape
+    rows = num_hashes // bands
+    pairs = []
+    skipped = 0
+    for band in range(bands):
+        # one 64 bit key per identity and band, collisions only add candidates that are checked anyway
+        keys = np.zeros(n, dtype=np.uint64)
+        for column in signatures[:, band*rows:(band+1)*rows].T:
+            keys = keys * np.uint64(0x9e3779b97f4a7c15) + column.astype(np.uint64)
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        sizes = np.diff(np.r_[starts, n])
+        for start, size in zip(starts[sizes > 1], sizes[sizes > 1]):
+            if size > max_bucket:
+                skipped += 1
+                continue
+            members = np.sort(order[start:start+size])
+            first, second = np.triu_indices(size, 1)
+            pairs.append(members[first] * n + members[second])
+    if skipped > 0:
+        print('Skipped {} LSH buckets with more than {} identities'.format(skipped, max_bucket), file=sys.stderr)
+    if len(pairs) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    pairs = np.unique(np.concatenate(pairs))
+    return np.stack([pairs // n, pairs % n], axis=1)
+
+def similar_identities(identities, coauthors, min_jaccard=MIN_JACCARD, min_coauthors=MIN_COAUTHORS):
+    '''Returns (jaccard, shared, a, b) for every pair of identities whose coauthor sets have at least
+    min_jaccard similarity, most similar first. a and b index identities.'''
+    candidates = [i for i in range(len(identities)) if len(coauthors[i]) >= min_coauthors]
+    signatures = minhash_signatures([coauthors[i] for i in candidates])
+    similar = []
+    for first, second in lsh_candidates(signatures):
+        a, b = candidates[first], candidates[second]
+        shared = len(coauthors[a] & coauthors[b])
+        jaccard = shared / (len(coauthors[a]) + len(coauthors[b]) - shared)
+        if jaccard >= min_jaccard:
+            similar.append((jaccard, shared, a, b))
+    similar.sort(key=lambda pair: (-pair[0], pair[2], pair[3]))
+    return similar
+
+def describe(identity):
+    return '{} {} <{}>'.format(identity.role, identity.name, identity.email)
+
+def write_report(similar, identities, coauthors, report_file):
+    # JSON if the file name asks for it, CSV otherwise, as in check_reviews.py
+    rows = []
+    for jaccard, shared, a, b in similar:
+        row = {'jaccard': round(jaccard, 3), 'shared': shared}
+        for suffix, i in (('a', a), ('b', b)):
+            identity = identities[i]
+            row.update({'name_'+suffix: identity.name, 'email_'+suffix: identity.email, 'dblp_'+suffix: identity.dblp,
+                        'role_'+suffix: identity.role, 'coauthors_'+suffix: len(coauthors[i])})
+        rows.append(row)
+    with open(report_file, 'w', encoding='utf8', newline='') as f:
+        if report_file.endswith('.json'):
+            json.dump(rows, f, indent=1)
+        else:
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    timers = instrument.pop_profile(sys.argv)
+    min_jaccard = instrument.parse_number(instrument.pop_option(sys.argv, '--min-jaccard', MIN_JACCARD), float, 0)
+    # optional submitting authors: --authors hotcrp-authors.csv dblp-index
+    authors = instrument.pop_option(sys.argv, '--authors', (None, None), 2)
+    if (len(sys.argv) != 2 and len(sys.argv) != 3) or min_jaccard == None or min_jaccard > 1 or authors == None:
+        print('Find identities with nearly the same coauthors. Run the script with: python3 {} [--min-jaccard {}] [--authors hotcrp-authors.csv dblp-index] [--profile timings.json|stats.prof] hotcrp-users-mapped.db [identities.csv|identities.json]'.format(sys.argv[0], MIN_JACCARD))
+        exit(1)
+    with timers.stage('coauthor sets'):
+        store = CoauthorStore(sys.argv[1])
+        authors_csv, index_dir = authors
+        if authors_csv != None:
+            prefetch([authors_csv])
+            identities, coauthors = index_identities(store, authors_csv, index_dir)
+        else:
+            identities, coauthors = store_identities(store)
+        store.close()
+
+    with timers.stage('similar identities'):
+        similar = similar_identities(identities, coauthors, min_jaccard)
+    for jaccard, shared, a, b in similar:
+        same = ' under the same DBLP name' if identities[a].dblp == identities[b].dblp else ''
+        print('Possible duplicate identity{}: {} and {} share {} of {} coauthors (Jaccard {:.2f})'.format(same, describe(identities[a]), describe(identities[b]), shared, len(coauthors[a] | coauthors[b]), jaccard))
+    print('Compared {} identities, {} pairs have a Jaccard similarity of at least {}'.format(len(identities), len(similar), min_jaccard))
+    if len(sys.argv) == 3:
+        write_report(similar, identities, coauthors, sys.argv[2])
+    timers.finish()
@@ -5,24 +5,19 @@ You need two inputs from HotCRP on the paper overview:
 - Reviews/Scores (CSV)
 - Paper Information/Authors (CSV)
 '''
-import lxml.etree as ET
-from gzip import GzipFile
-import pickle
 import csv
-import re
+import hashlib
+import json
+import os
+import pickle
 import sys
-from datetime import datetime
-
-class Author():
-    def __init__(self, name, email, orcid, dblp):
-        self.name = name
-        self.email = email
-        self.orcid = orcid
-        self.dblp = dblp
-        self.coauthors = {}
-        current_year = datetime.now().year
-        for i in range(0,6):
-            self.coauthors[current_year-i] = []
+
+from coauthor_store import CoauthorStore
+from hotcrp import export_name, prefetch, read_export
+import instrument
+
+REPORT_FIELDS = ['paper', 'title', 'reviewer', 'email', 'author', 'year', 'hops', 'via']
+CHECKPOINT_VERSION = 1
 
 class Paper():
     def __init__(self, num, title, authors):
@@ -30,67 +25,220 @@ class Paper():
         self.title = title
         self.authors = authors
 
-def load_coauthors(coauthor_file):
-    with open(coauthor_file, 'rb') as f:
-        reviewers = pickle.load(f)
-        f.close()
-    return reviewers
-
-def get_papers(authors_csv):
-    papers = []
-    with open(authors_csv, 'r') as f:
-        hotcrp_users_csv = csv.reader(f)
-        paper = None
-        for row in hotcrp_users_csv:
-            if row[0] == 'paper':
-                continue
-            if paper == None:
-                paper = Paper(row[0], row[1], [row[2]+' '+row[3]])
-                continue
-            paper.authors.append(row[2]+' '+row[3])
-            if row[0] != paper.num:
-                papers.append(paper)
-                paper = Paper(row[0], row[1], [row[2]+' '+row[3]])
-        papers.append(paper)
+def get_papers(authors_csv, aliases={}):
+    # map paper id -> Paper; the authors export has one row per author
+    # authors are renamed to their canonical DBLP name, which the coauthor store uses
+    papers = {}
+    for paper_id, title, first, last in read_export(authors_csv, ('paper', 'title', 'first', 'last')):
+        if paper_id not in papers:
+            papers[paper_id] = Paper(paper_id, title, [])
+        papers[paper_id].authors.append(aliases.get(first+' '+last, first+' '+last))
     return papers
 
-def check_conflicts(scores_csv, papers, reviewers):
-    with open(scores_csv, 'r') as f:
-        scores_csv = csv.reader(f)
-        for row in scores_csv:
-            if row[0] == 'paper':
-                continue
-            reviewer_email = row[5]
-            paper_id = row[0]
-            for paper in papers:
-                if paper.num == paper_id:
-                    break
-            if paper.num != paper_id:
-                print('Did not find reviews for {}'.format(paper_id))
+def indirect_conflicts(store, papers, index_dir, hops):
+    # map reviewer email -> map author -> (hops, weight, via) for submitting authors 2..hops away in DBLP
+    from dblp_index import DblpIndex
+    import transitive_conflicts
+    index = DblpIndex(index_dir)
+    adjacency = transitive_conflicts.window_adjacency(index, store.year)
+    aliases = index.aliases()
+    def author_ids(name):
+        # publications under former names count as well
+        return [index.author_id(alias) for alias in aliases.names_of(name) if index.author_id(alias) != None]
+    reviewers = [reviewer for reviewer in store.reviewers() if len(author_ids(reviewer.dblp)) > 0]
+    sources = [author_ids(reviewer.dblp) for reviewer in reviewers]
+    # map author id -> submitting author, the papers use the canonical names
+    targets = {}
+    for paper_id in papers:
+        for author in papers[paper_id].authors:
+            for aid in author_ids(author):
+                targets[aid] = author
+    indirect = {}
+    for row, target, hop, weight, via in transitive_conflicts.khop_conflicts(adjacency, sources, targets, hops):
+        found = indirect.setdefault(reviewers[row].email, {})
+        # an author with several names keeps the closest and strongest one
+        if targets[target] not in found or (hop, -weight) < (found[targets[target]][0], -found[targets[target]][1]):
+            found[targets[target]] = (hop, weight, index.names[via])
+    return indirect
+
+class ReviewerIndex():
+    # map reviewer email -> (DBLP name, map coauthor -> years), filled from the store on first use
+    def __init__(self, store):
+        self.store = store
+        self.by_email = {}
+
+    def get(self, email):
+        if email not in self.by_email:
+            reviewer = self.store.reviewer_by_email(email)
+            self.by_email[email] = (reviewer.dblp, self.store.coauthor_years(reviewer)) if reviewer != None else None
+        return self.by_email[email]
+
+def check_pairs(pairs, papers, reviewers, indirect={}, log=print):
+    # pairs of (paper id, reviewer email), reviewers maps email -> (DBLP name, map coauthor -> years)
+    conflicts = []
+    for paper_id, reviewer_email in pairs:
+        if paper_id not in papers:
+            log('Did not find reviews for {}'.format(paper_id))
+            continue
+        if reviewers.get(reviewer_email) == None:
+            log('Found a reviewer that is not in users: {}'.format(reviewer_email))
+            continue
+        paper = papers[paper_id]
+        reviewer, coauthor_years = reviewers.get(reviewer_email)
+        found = [(year, author) for author in paper.authors for year in coauthor_years.get(author, ())]
+        # most recent coauthorships first
+        found.sort(key=lambda conflict: -conflict[0])
+        for year, author in found:
+            log('Possible conflict: {} reviewed paper {} but is conflicted with {} in {}'.format(reviewer, paper_id, author, year))
+            conflicts.append({'paper': paper_id, 'title': paper.title, 'reviewer': reviewer, 'email': reviewer_email, 'author': author, 'year': year, 'hops': 1, 'via': ''})
+        for author in paper.authors:
+            if author in indirect.get(reviewer_email, {}) and author not in coauthor_years:
+                hops, weight, via = indirect[reviewer_email][author]
+                log('Possible indirect conflict: {} reviewed paper {} but is {} hops from {} via {} ({} shared paper paths)'.format(reviewer, paper_id, hops, author, via, weight))
+                conflicts.append({'paper': paper_id, 'title': paper.title, 'reviewer': reviewer, 'email': reviewer_email, 'author': author, 'year': '', 'hops': hops, 'via': via})
+    return conflicts
+
+def check_conflicts(scores_csv, papers, store, indirect={}):
+    return check_pairs(read_export(scores_csv, ('paper', 'email')), papers, ReviewerIndex(store), indirect)
+
+def digest(value):
+    return hashlib.sha1(repr(value).encode('utf8')).hexdigest()
+
+def file_digest(filename):
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1024*1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def new_checkpoint(hops):
+    # what earlier runs already checked, so that the next export only costs its new reviews
+    return {'version': CHECKPOINT_VERSION, 'hops': hops,
+            'data': '',       # digest of the coauthor store (and the DBLP index for --hops)
+            'papers': {},     # paper id -> digest of title and authors
+            'reviewers': {},  # email -> digest of the coauthors (and indirect conflicts)
+            'pairs': set()}   # (paper id, email) already checked
+
+def load_checkpoint(checkpoint_file, hops):
+    if not os.path.exists(checkpoint_file):
+        return None
+    with open(checkpoint_file, 'rb') as f:
+        checkpoint = pickle.load(f)
+    return checkpoint if checkpoint['version'] == CHECKPOINT_VERSION and checkpoint['hops'] == hops else None
+
+def check_incremental(scores_csv, papers, store, data_digest, checkpoint, indirect={}):
+    '''Check only the pairs of the scores export that were not checked before, or whose paper or
+    reviewer changed since. Updates the checkpoint and returns the new conflicts.'''
+    reviewers = ReviewerIndex(store)
+    paper_digests = {paper_id: digest((papers[paper_id].title, papers[paper_id].authors)) for paper_id in papers}
+    reviewer_digests = {}
+    def reviewer_digest(email):
+        if email not in reviewer_digests:
+            entry = reviewers.get(email)
+            reviewer_digests[email] = digest((sorted(entry[1].items()), sorted(indirect.get(email, {}).items()))) if entry != None else ''
+        return reviewer_digests[email]
+    data_changed = data_digest != checkpoint['data']
+    pairs = list(read_export(scores_csv, ('paper', 'email')))
+    pending = []
+    for paper_id, email in pairs:
+        if (paper_id, email) in checkpoint['pairs'] and paper_digests.get(paper_id) == checkpoint['papers'].get(paper_id):
+            # with the same store only new pairs and changed papers matter, otherwise compare the reviewer
+            if not data_changed and email in checkpoint['reviewers']:
                 continue
-                #assert(paper.num == paper_id)
-            for reviewer in reviewers:
-                if reviewers[reviewer].email == reviewer_email:
-                    break
-            if reviewers[reviewer].email != reviewer_email:
-                print('Found a reviewer that is not in users: {}'.format(reviewer_email))
+            if data_changed and reviewer_digest(email) == checkpoint['reviewers'].get(email):
                 continue
-            for year in reviewers[reviewer].coauthors:
-                for author in paper.authors:
-                    if author in reviewers[reviewer].coauthors[year]:
-                        print('Possible conflict: {} reviewed paper {} but is conflicted with {} in {}'.format(reviewer, paper_id, author, year))
+        pending.append((paper_id, email))
+    conflicts = check_pairs(pending, papers, reviewers, indirect)
+    print('Checked {} of {} reviews, the others are unchanged since the last run'.format(len(pending), len(pairs)))
+
+    for paper_id, email in pending:
+        reviewer_digest(email)
+        checkpoint['pairs'].add((paper_id, email))
+    if data_changed:
+        # digests of reviewers not seen in this export are stale, their pairs are checked again
+        checkpoint['reviewers'] = {}
+    checkpoint['reviewers'].update(reviewer_digests)
+    checkpoint['papers'] = paper_digests
+    checkpoint['data'] = data_digest
+    return conflicts
+
+def write_report(conflicts, report_file):
+    # JSON if the file name asks for it, CSV otherwise
+    with open(report_file, 'w', encoding='utf8', newline='') as f:
+        if report_file.endswith('.json'):
+            json.dump(conflicts, f, indent=1)
+        else:
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(conflicts)
+
+def summary_lines(store):
+    counts = store.year_counts()
+    return ['{} -> {}'.format(reviewer.dblp, ' '.join(str(counts.get(reviewer.rid, {}).get(year, 0)) for year in store.years)) for reviewer in store.reviewers()]
+
+def print_summary(store):
+    for line in summary_lines(store):
+        print(line)
+
+def check_server(server, scores_csv):
+    # same checks and output, answered by a running conflict_server.py
+    from conflict_server import query
+    for line in query(server, '/summary')['summary']:
+        print(line)
+    result = query(server, '/check', {'pairs': list(read_export(scores_csv, ('paper', 'email')))})
+    for line in result['messages']:
+        print(line)
+    return result['conflicts']
 
 if __name__ == '__main__':
-    if len(sys.argv) != 4:
-        print('Check reviews for missed conflicts. Run the script with: python3 {} hotcrp-users-mapped.pickle hotcrp-authors.csv hotcrp-scores.csv'.format(sys.argv[0]))
+    timers = instrument.pop_profile(sys.argv)
+    # optional transitive conflicts: --hops K dblp-index
+    hops, index_dir = instrument.pop_option(sys.argv, '--hops', (1, None), 2) or (None, None)
+    hops = instrument.parse_number(hops)
+    # optional resident server: --server URL replaces the store and the authors export
+    if '--server' in sys.argv:
+        server = instrument.pop_option(sys.argv, '--server', None)
+        if (len(sys.argv) != 2 and len(sys.argv) != 3) or server == None:
+            print('Check reviews against a running conflict_server.py. Run the script with: python3 {} --server http://127.0.0.1:8642 hotcrp-scores.csv [conflicts.csv|conflicts.json]'.format(sys.argv[0]))
+            exit(1)
+        with timers.stage('check conflicts'):
+            conflicts = check_server(server, sys.argv[1])
+        if len(sys.argv) == 3:
+            write_report(conflicts, sys.argv[2])
+        timers.finish()
+        exit(0)
+    # only check what changed since the last run on this scores export
+    incremental = '--incremental' in sys.argv
+    if incremental:
+        sys.argv.remove('--incremental')
+    if (len(sys.argv) != 4 and len(sys.argv) != 5) or hops == None:
+        print('Check reviews for missed conflicts. Run the script with: python3 {} [--hops K dblp-index] [--incremental] [--profile timings.json|stats.prof] hotcrp-users-mapped.db hotcrp-authors.csv hotcrp-scores.csv [conflicts.csv|conflicts.json]'.format(sys.argv[0]))
         exit(1)
-    # Load reviewer and coauthor information
-    reviewers = load_coauthors(sys.argv[1])
-
-    current_year = datetime.now().year
-    for reviewer in reviewers:
-        print('{} -> {} {} {} {} {} {}'.format(reviewer, len(reviewers[reviewer].coauthors[current_year]), len(reviewers[reviewer].coauthors[current_year-1]), len(reviewers[reviewer].coauthors[current_year-2]), len(reviewers[reviewer].coauthors[current_year-3]), len(reviewers[reviewer].coauthors[current_year-4]), len(reviewers[reviewer].coauthors[current_year-5])))
+    # Open reviewer and coauthor information, coauthors are loaded per reviewer as needed
+    with timers.stage('open store'):
+        store = CoauthorStore(sys.argv[1])
+        print_summary(store)
 
-    papers = get_papers(sys.argv[2])
+    with timers.stage('read papers'):
+        prefetch(sys.argv[2:4])
+        papers = get_papers(sys.argv[2], store.aliases())
 
-    check_conflicts(sys.argv[3], papers, reviewers)
\ No newline at end of file
+    with timers.stage('indirect conflicts'):
+        indirect = indirect_conflicts(store, papers, index_dir, hops) if hops > 1 else {}
+    if incremental:
+        checkpoint_file = export_name(sys.argv[3])[:-4]+'-checked.pickle'
+        with timers.stage('check new conflicts'):
+            checkpoint = load_checkpoint(checkpoint_file, hops)
+            if checkpoint == None:
+                checkpoint = new_checkpoint(hops)
+            data_digest = digest((file_digest(sys.argv[1]), file_digest(os.path.join(index_dir, 'meta.json')) if hops > 1 else ''))
+            conflicts = check_incremental(sys.argv[3], papers, store, data_digest, checkpoint, indirect)
+        with timers.stage('write checkpoint'):
+            with open(checkpoint_file, 'wb') as f:
+                pickle.dump(checkpoint, f)
+    else:
+        with timers.stage('check conflicts'):
+            conflicts = check_conflicts(sys.argv[3], papers, store, indirect)
+    if len(sys.argv) == 5:
+        write_report(conflicts, sys.argv[4])
+    timers.finish()
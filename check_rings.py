@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+'''
+The goal of this script is to find bidding rings: PC members that bid on each other's papers.
+check_bidding.py and compute_bai.py look at each reviewer on their own, rings only show up as
+structure between reviewers (A bids on B's papers, B on C's, and C on A's).
+
+From allprefs and the authors export we build a sparse directed reviewer -> reviewer graph. The
+weight of A -> B is the share of A's significant positive preference that went to papers
+co-authored by B (the same share compute_bai.py reports per author). The script then reports
+- reciprocal pairs: A -> B and B -> A,
+- bidding cycles: strongly connected components of two or more reviewers,
+- dense groups: the densest subgraph of each connected part of the graph.
+All steps are linear in the number of bids (up to a log factor for the dense groups).
+'''
+import heapq
+import sys
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse import csgraph
+
+from check_bidding import load_bids
+from hotcrp import prefetch, read_export
+import instrument
+
+MIN_POSITIVE_PREFERENCE = 5 # bids below are not significant
+MIN_EDGE_SHARE = 0.10 # ignore reviewer -> reviewer edges with less of the bidder's preference
+MIN_GROUP_DENSITY = 0.20 # report groups whose members send at least this share to each other on average
+MIN_GROUP_SIZE = 3
+
+def read_paper_emails(papers_csv):
+    # map paper id -> author emails (lowercase)
+    paper_emails = {}
+    for paper_id, email in read_export(papers_csv, ('paper', 'email')):
+        if email != '':
+            paper_emails.setdefault(paper_id, []).append(email.lower())
+    return paper_emails
+
+def reviewer_graph(bids, paper_emails):
+    nr_reviewers = len(bids.emails)
+    reviewer_ids = {email.lower(): r for r, email in enumerate(bids.emails)}
+    # paper x reviewer matrix of the PC members that co-authored each paper
+    rows, cols = [], []
+    for p, paper_id in enumerate(bids.papers):
+        for email in paper_emails.get(paper_id, ()):
+            if email in reviewer_ids:
+                rows.append(p)
+                cols.append(reviewer_ids[email])
+    authored = sp.csr_matrix((np.ones(len(rows), dtype=np.float64), (rows, cols)), shape=(len(bids.papers), nr_reviewers))
+    authored.data[:] = 1
+
+    significant = bids.preference >= MIN_POSITIVE_PREFERENCE
+    prefs = sp.csr_matrix((bids.preference[significant].astype(np.float64), (bids.reviewer[significant], bids.paper[significant])), shape=(nr_reviewers, len(bids.papers)))
+    total = np.asarray(prefs.sum(axis=1)).ravel()
+    total[total == 0] = 1
+    graph = (sp.diags(1/total) @ (prefs @ authored)).tocsr()
+    graph.setdiag(0)
+    graph.data[graph.data < MIN_EDGE_SHARE] = 0
+    graph.eliminate_zeros()
+    return graph
+
+def reciprocal_pairs(graph):
+    both = graph.multiply(graph.T).tocoo()
+    return [(int(a), int(b), graph[a, b], graph[b, a]) for a, b in zip(both.row, both.col) if a < b]
+
+def bidding_cycles(graph):
+    count, labels = csgraph.connected_components(graph, directed=True, connection='strong')
+    sizes = np.bincount(labels, minlength=count)
+    return [np.flatnonzero(labels == label) for label in np.flatnonzero(sizes >= 2)]
+
+def group_density(graph, members):
+    # average share of preference that members send to other members
+    return graph[members][:, members].sum()/len(members)
+
+def densest_subgraph(undirected, nodes):
+    # greedy peeling: repeatedly drop the member with the least weight to the others, keep the best group
+    # nodes form a connected part of the graph, so all their neighbors are in it
+    strength = np.asarray(undirected.sum(axis=1)).ravel()
+    degree = {int(n): strength[n] for n in nodes}
+    weight = sum(degree.values())/2
+    heap = [(degree[n], n) for n in degree]
+    heapq.heapify(heap)
+    alive = set(degree)
+    best, best_density = set(alive), weight/len(alive)
+    while len(alive) > 2:
+        d, n = heapq.heappop(heap)
+        if n not in alive or d != degree[n]:
+            continue
+        alive.remove(n)
+        weight -= degree[n]
+        row = undirected.getrow(n)
+        for m, w in zip(row.indices, row.data):
+            if m in alive:
+                degree[m] -= w
+                heapq.heappush(heap, (degree[m], m))
+        if weight/len(alive) > best_density:
+            best, best_density = set(alive), weight/len(alive)
+    return sorted(best)
+
+def dense_groups(graph):
+    groups = []
+    undirected = (graph + graph.T).tocsr()
+    count, labels = csgraph.connected_components(graph, directed=True, connection='weak')
+    sizes = np.bincount(labels, minlength=count)
+    for label in np.flatnonzero(sizes >= MIN_GROUP_SIZE):
+        members = densest_subgraph(undirected, np.flatnonzero(labels == label))
+        if len(members) >= MIN_GROUP_SIZE and group_density(graph, members) >= MIN_GROUP_DENSITY:
+            groups.append(members)
+    return groups
+
+def describe(bids, r):
+    return '{} <{}>'.format(bids.names[r], bids.emails[r])
+
+
+if __name__ == '__main__':
+    timers = instrument.pop_profile(sys.argv)
+    if len(sys.argv) != 3:
+        print('Check allpref data for bidding rings between PC members. Run the script with: python3 {} [--profile timings.json|stats.prof] hotcrp-authors.csv hotcrp-allprefs.csv'.format(sys.argv[0]))
+        exit(1)
+
+    with timers.stage('load bids'):
+        prefetch(sys.argv[1:3])
+        paper_emails = read_paper_emails(sys.argv[1])
+        bids = load_bids(sys.argv[2])
+    with timers.stage('reviewer graph'):
+        graph = reviewer_graph(bids, paper_emails)
+
+    with timers.stage('find rings'):
+        for a, b, ab, ba in reciprocal_pairs(graph):
+            print('Reciprocal bids: {} gave {:.0f}% of their preference to papers of {}, who gave {:.0f}% back'.format(describe(bids, a), ab*100, describe(bids, b), ba*100))
+        for members in bidding_cycles(graph):
+            if len(members) > 2:
+                print('Bidding cycle of {} reviewers (density {:.2f}): {}'.format(len(members), group_density(graph, members), ', '.join(describe(bids, r) for r in members)))
+        for members in dense_groups(graph):
+            print('Dense bidding group of {} reviewers (density {:.2f}): {}'.format(len(members), group_density(graph, members), ', '.join(describe(bids, r) for r in members)))
+    timers.finish()
@@ -1,54 +1,172 @@
 #!/usr/bin/python3
 '''
 The goal of this script is to quickly match number of submissions and authors
+Authors of many exports (e.g., all venues and years of a conference series) are merged into persons:
+entries that share an email are the same person, and so are entries with the same normalized name
+(case, accents, and punctuation ignored) and the same email domain, so two emails or two spellings
+of a name are counted together. A name alone does not merge, homonyms are different people; persons
+with the same name are only listed next to each other. Use --emails-only to merge on emails alone.
+Exports are counted one at a time, in parallel with -j, and only distinct authors are kept in memory.
 '''
-import csv
+from collections import Counter
+import multiprocessing
+import re
 import sys
+import unicodedata
 
-def check_conflicts(scores_csv, papers, reviewers):
-    with open(scores_csv, 'r') as f:
-        scores_csv = csv.reader(f)
-        for row in scores_csv:
-            if row[0] == 'paper':
-                continue
-            reviewer_email = row[5]
-            paper_id = row[0]
-            for paper in papers:
-                if paper.num == paper_id:
-                    break
-            if paper.num != paper_id:
-                print('Did not find reviews for {}'.format(paper_id))
-                continue
-                #assert(paper.num == paper_id)
-            for reviewer in reviewers:
-                if reviewers[reviewer].email == reviewer_email:
-                    break
-            if reviewers[reviewer].email != reviewer_email:
-                print('Found a reviewer that is not in users: {}'.format(reviewer_email))
-                continue
-            for year in reviewers[reviewer].coauthors:
-                for author in paper.authors:
-                    if author in reviewers[reviewer].coauthors[year]:
-                        print('Possible conflict: {} reviewed paper {} but is conflicted with {} in {}'.format(reviewer, paper_id, author, year))
+from hotcrp import read_export
+import instrument
+
+NON_WORD_RE = re.compile(r'[\W_]+')
+# anybody can have an address there, a shared domain says nothing about the person
+WEBMAIL_DOMAINS = {'gmail.com', 'googlemail.com', 'outlook.com', 'hotmail.com', 'live.com', 'yahoo.com', 'icloud.com', 'qq.com', '163.com', '126.com', 'proton.me', 'protonmail.com'}
+
+def normalize_name(first, last):
+    # "José  García-López" and "Jose Garcia Lopez" are the same name
+    name = first+' '+last
+    if not name.isascii():
+        name = unicodedata.normalize('NFKD', name)
+        name = ''.join(c for c in name if not unicodedata.combining(c))
+    return NON_WORD_RE.sub(' ', name.casefold()).strip()
+
+def normalize_email(email):
+    return email.strip().lower()
+
+def email_domain(email):
+    # the domain that corroborates a name, '' for none or a webmail domain
+    domain = email.rpartition('@')[2] if '@' in email else ''
+    return domain if domain not in WEBMAIL_DOMAINS else ''
+
+def label(author):
+    first, last, email = author
+    return first+' '+last+' <'+email+'>'
+
+class Identities():
+    '''Union-find over the emails and the normalized names with email domain of author entries.'''
+    def __init__(self, names=True):
+        self.names = names
+        self.email_nodes = {} # normalized email -> node
+        self.name_nodes = {} # (normalized name, email domain) -> node
+        self.parent = []
+        self.size = []
+        self.entries = {}  # author entry (first, last, email) -> node
+        self.counts = {}   # author entry -> number of rows
+
+    def node(self, nodes, key):
+        node = nodes.setdefault(key, len(self.parent))
+        if node == len(self.parent):
+            self.parent.append(node)
+            self.size.append(1)
+        return node
+
+    def find(self, node):
+        # path halving keeps the trees flat
+        parent = self.parent
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    def union(self, a, b):
+        a = self.find(a)
+        b = self.find(b)
+        if a == b:
+            return
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+
+    def add(self, counts):
+        '''Add the author entries of one export, counts maps (first, last, email) -> rows.'''
+        known = self.counts
+        for author, count in counts.items():
+            if author in known:
+                known[author] += count
+            else:
+                # only entries not seen in earlier exports need to be linked
+                self.link(author)
+                known[author] = count
+
+    def link(self, author):
+        # an entry is the node of its email joined with the node of its name at its email domain,
+        # without an email domain the name only joins entries with the same email
+        first, last, email = author
+        email = normalize_email(email)
+        name = normalize_name(first, last) if self.names else ''
+        nodes = []
+        if email != '':
+            nodes.append(self.node(self.email_nodes, email))
+        if name != '' and email_domain(email) != '':
+            nodes.append(self.node(self.name_nodes, (name, email_domain(email))))
+        if len(nodes) == 0:
+            # neither email nor name, the entry is a person of its own
+            nodes.append(self.node(self.email_nodes, author))
+        elif len(nodes) == 2:
+            self.union(nodes[0], nodes[1])
+        self.entries[author] = nodes[0]
+
+    def persons(self):
+        '''Returns a list of (submissions, author entries) per person, the most used entry first.'''
+        groups = {}
+        for author in self.counts:
+            groups.setdefault(self.find(self.entries[author]), []).append(author)
+        persons = []
+        for authors in groups.values():
+            authors.sort(key=lambda author: (-self.counts[author], label(author)))
+            persons.append((sum(self.counts[author] for author in authors), authors))
+        return persons
+
+    def namesakes(self, persons):
+        '''Returns for each of the persons the indexes of the other persons with one of its names,
+        homonyms or the same person under unrelated emails, which a name alone does not merge.'''
+        by_name = {}
+        names = []
+        for i, (count, authors) in enumerate(persons):
+            names.append(set(normalize_name(first, last) for first, last, email in authors) - {''})
+            for name in names[i]:
+                by_name.setdefault(name, []).append(i)
+        return [sorted(set(j for name in names[i] for j in by_name[name]) - {i}) for i in range(len(persons))]
+
+def count_export(authors_csv):
+    # map (first, last, email) -> rows of one export, runs in a worker process
+    return Counter(read_export(authors_csv, ('first', 'last', 'email')))
+
+def count_submissions(exports, identities, workers=1):
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            partials = pool.imap(count_export, exports)
+            for authors_csv, counts in zip(exports, partials):
+                print(authors_csv)
+                identities.add(counts)
+    else:
+        for authors_csv in exports:
+            print(authors_csv)
+            identities.add(count_export(authors_csv))
 
 if __name__ == '__main__':
-    if len(sys.argv) == 1:
-        print('Check author data for total number of submissions. Run the script with: python3 {} hotcrp-authors.csv [hotcrp-author2.csv ...]'.format(sys.argv[0]))
+    workers = instrument.pop_workers(sys.argv)
+    emails_only = '--emails-only' in sys.argv
+    if emails_only:
+        sys.argv.remove('--emails-only')
+    timers = instrument.pop_profile(sys.argv)
+    if len(sys.argv) == 1 or workers < 1:
+        print('Check author data for total number of submissions. Run the script with: python3 {} [-j workers] [--emails-only] [--profile timings.json|stats.prof] hotcrp-authors.csv [hotcrp-author2.csv ...]'.format(sys.argv[0]))
         exit(1)
 
-    authors = {}
-    for i in range(len(sys.argv)-1):
-        print(sys.argv[i+1])
-        with open(sys.argv[i+1], 'r') as f:
-            authors_csv = csv.reader(f)
-            for row in authors_csv:
-                if row[0] == 'paper':
-                    continue
-                reviewer = row[2]+' '+row[3]+' <'+row[4]+'>'
-                if reviewer in authors:
-                    authors[reviewer] += 1
-                else:
-                    authors[reviewer] = 1
-    sorted_authors = sorted(authors.items(), key=lambda kv: (kv[1], kv[0]))
-    for pair in sorted_authors:
-        print(pair)
+    identities = Identities(not emails_only)
+    with timers.stage('count submissions'):
+        count_submissions(sys.argv[1:], identities, workers)
+    with timers.stage('resolve identities'):
+        persons = identities.persons()
+    persons.sort(key=lambda person: (person[0], label(person[1][0])))
+    namesakes = identities.namesakes(persons)
+    for i, (count, authors) in enumerate(persons):
+        print((label(authors[0]), count))
+        # the other emails and spellings of the same person
+        for author in authors[1:]:
+            print('    also {} ({})'.format(label(author), identities.counts[author]))
+        # check these by hand, the name alone is no proof
+        for j in namesakes[i]:
+            print('    same name as {} ({}), not merged'.format(label(persons[j][1][0]), persons[j][0]))
+    timers.finish()
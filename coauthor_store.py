@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+'''
+Versioned coauthor store written by find_coauthors.py and read by check_reviews.py and
+conflict_matrix.py.  It is a SQLite file with interned names, so consumers need none of the
+producer's classes and can query a single reviewer without loading everybody else:
+- meta: format version and the last year of the coauthorship window
+- names: every reviewer and coauthor name once
+- reviewers: DBLP name, HotCRP name, email, and ORCID of each reviewer
+- coauthors: one (reviewer, coauthor, year) row per coauthorship, the primary key makes it a set
+- aliases: other DBLP names of coauthors -> their canonical name, which the coauthors table uses
+'''
+import os
+import sqlite3
+
+STORE_VERSION = 2
+
+SCHEMA = '''
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE names (id INTEGER PRIMARY KEY, name TEXT NOT NULL);
+CREATE TABLE reviewers (id INTEGER PRIMARY KEY, dblp INTEGER NOT NULL, name TEXT, email TEXT, orcid TEXT);
+CREATE TABLE coauthors (reviewer INTEGER NOT NULL, coauthor INTEGER NOT NULL, year INTEGER NOT NULL,
+                        PRIMARY KEY (reviewer, coauthor, year)) WITHOUT ROWID;
+CREATE TABLE aliases (alias INTEGER PRIMARY KEY, person INTEGER NOT NULL);
+'''
+INDEXES = '''
+CREATE UNIQUE INDEX names_name ON names (name);
+CREATE INDEX reviewers_email ON reviewers (email);
+'''
+
+def write_store(store_file, reviewers, current_year, aliases={}):
+    '''Write reviewers (objects with name, email, orcid, dblp and a year -> coauthors map) in one pass,
+    aliases maps other names of coauthors to the name they are stored under.'''
+    if os.path.exists(store_file):
+        os.remove(store_file)
+    name_ids = {}
+    def intern(name):
+        if name not in name_ids:
+            name_ids[name] = len(name_ids)
+        return name_ids[name]
+    reviewer_rows = []
+    coauthor_rows = []
+    for rid, reviewer in enumerate(reviewers):
+        reviewer_rows.append((rid, intern(reviewer.dblp), reviewer.name, reviewer.email, reviewer.orcid))
+        for year in reviewer.coauthors:
+            for coauthor in reviewer.coauthors[year]:
+                coauthor_rows.append((rid, intern(coauthor), year))
+    alias_rows = [(intern(alias), intern(aliases[alias])) for alias in aliases]
+
+    db = sqlite3.connect(store_file)
+    with db:
+        db.executescript(SCHEMA)
+        db.executemany('INSERT INTO meta VALUES (?, ?)', [('version', str(STORE_VERSION)), ('year', str(current_year))])
+        db.executemany('INSERT INTO names VALUES (?, ?)', ((name_ids[name], name) for name in name_ids))
+        db.executemany('INSERT INTO reviewers VALUES (?, ?, ?, ?, ?)', reviewer_rows)
+        db.executemany('INSERT OR IGNORE INTO coauthors VALUES (?, ?, ?)', coauthor_rows)
+        db.executemany('INSERT INTO aliases VALUES (?, ?)', alias_rows)
+        db.executescript(INDEXES)
+    db.close()
+
+class Reviewer():
+    def __init__(self, rid, dblp, name, email, orcid):
+        self.rid = rid
+        self.dblp = dblp
+        self.name = name
+        self.email = email
+        self.orcid = orcid
+
+class CoauthorStore():
+    def __init__(self, store_file):
+        if not os.path.exists(store_file):
+            raise FileNotFoundError(store_file)
+        self.db = sqlite3.connect('file:{}?mode=ro'.format(store_file), uri=True)
+        meta = dict(self.db.execute('SELECT key, value FROM meta'))
+        if int(meta['version']) != STORE_VERSION:
+            raise ValueError('Coauthor store {} has version {}, expected {}; rerun find_coauthors.py'.format(store_file, meta['version'], STORE_VERSION))
+        self.year = int(meta['year'])
+        self.years = list(range(self.year, self.year-6, -1))
+
+    def reviewers(self):
+        return [Reviewer(*row) for row in self.db.execute('SELECT r.id, n.name, r.name, r.email, r.orcid FROM reviewers r JOIN names n ON n.id = r.dblp ORDER BY r.id')]
+
+    def reviewer_by_email(self, email):
+        row = self.db.execute('SELECT r.id, n.name, r.name, r.email, r.orcid FROM reviewers r JOIN names n ON n.id = r.dblp WHERE r.email = ? ORDER BY r.id', (email,)).fetchone()
+        return Reviewer(*row) if row != None else None
+
+    def coauthor_years(self, reviewer):
+        # map coauthor -> years of coauthorship, most recent first
+        coauthors = {}
+        for name, year in self.db.execute('SELECT n.name, c.year FROM coauthors c JOIN names n ON n.id = c.coauthor WHERE c.reviewer = ? ORDER BY c.year DESC', (reviewer.rid,)):
+            coauthors.setdefault(name, []).append(year)
+        return coauthors
+
+    def aliases(self):
+        # map other name -> canonical name, look names up here before matching them against coauthors
+        return dict(self.db.execute('SELECT a.name, p.name FROM aliases x JOIN names a ON a.id = x.alias JOIN names p ON p.id = x.person'))
+
+    def year_counts(self):
+        # map reviewer id -> year -> number of coauthors, without loading the coauthors
+        counts = {}
+        for rid, year, count in self.db.execute('SELECT reviewer, year, COUNT(*) FROM coauthors GROUP BY reviewer, year'):
+            counts.setdefault(rid, {})[year] = count
+        return counts
+
+    def close(self):
+        self.db.close()
+
+def index_reviewers(store):
+    # map reviewer email -> (DBLP name, map coauthor -> years) of every reviewer in the store
+    return {reviewer.email: (reviewer.dblp, store.coauthor_years(reviewer)) for reviewer in store.reviewers()}
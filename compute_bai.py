@@ -2,11 +2,110 @@
 '''
 The goal of this script is to compute statistical information regarding PC members bidding
 for papers.  The code is based on Mathias Payer's code at
- https://github.com/HexHive/inquisitor/blob/main/check_bidding.py. 
+ https://github.com/HexHive/inquisitor/blob/main/check_bidding.py.
+
+The cycles to analyze are listed in a manifest CSV, paths are relative to the manifest:
+  conference,year,cycle,authors,allprefs
+  NDSS,2024,summer,data/ndss24-summer-authors.csv,data/ndss24-summer-allprefs.csv
+  NDSS,2024,fall,data/ndss24-fall-authors.csv,data/ndss24-fall-allprefs.csv
+  CCS,2024,a,data/ccs2024a-authors.csv,data/ccs2024a-allprefs.csv
+Cycles are parsed in parallel and merged into one Conference.  Each parsed cycle is cached in
+compact binary form under a hash of its input files, so reruns with other thresholds skip the
+CSV parsing.
 '''
+from array import array
 import csv
+import hashlib
+import multiprocessing
+import os
+import pickle
 import sys
 
+from hotcrp import export_bytes, is_api, prefetch, read_export
+import instrument
+
+CACHE_VERSION = 2
+MIN_POSITIVE_PREFERENCE = 5 # bids below are not significant
+MIN_AUTHOR_BIDS = 3 # report if at least X significant bids went to the same author
+MIN_AUTHOR_BIDS_FRACTION = (2, 0.5) # or at least X bids that cover this fraction of the author's papers
+
+class Cycle:
+    # one authors/allprefs export pair, parsed into interned strings and integer arrays
+    def __init__(self, label):
+        self.label = label
+        self.authors = []                # author index -> email
+        self.author_names = []           # author index -> full name
+        self.papers = []                 # paper index -> paper id in HotCRP
+        self.paper_ptr = array('i', [0]) # CSR paper -> author indexes
+        self.paper_authors = array('i')
+        self.reviewers = []              # reviewer index -> (first name, last name, email)
+        self.bid_reviewer = array('i')   # per bid: reviewer index, paper index (-1 if unknown), preference, topic score
+        self.bid_paper = array('i')
+        self.bid_preference = array('i')
+        self.bid_topic_score = array('i')
+
+def read_cycle(cycle, authors_csv_filename, allpref_csv_filename):
+    parsed = Cycle(cycle)
+    # read from the csv file containing all authors
+    author_ids = {}
+    paper_lists = {}  # map paper id -> list of author indexes
+    for paper_id, first_name, last_name, email in read_export(authors_csv_filename, ('paper', 'first', 'last', 'email')):
+        if email == "":
+            continue
+        if not email in author_ids:
+            author_ids[email] = len(parsed.authors)
+            parsed.authors.append(email)
+            parsed.author_names.append('{} {}'.format(first_name, last_name))
+        paper_lists.setdefault(paper_id, []).append(author_ids[email])
+    paper_ids = {}
+    for paper_id in paper_lists:
+        paper_ids[paper_id] = len(parsed.papers)
+        parsed.papers.append(paper_id)
+        parsed.paper_authors.extend(paper_lists[paper_id])
+        parsed.paper_ptr.append(len(parsed.paper_authors))
+
+    # read from the csv file containing all preferences
+    reviewer_ids = {}
+    for paper_id, first_name, last_name, email, preference, topic_score in read_export(allpref_csv_filename, ('paper', 'given_name', 'family_name', 'email', 'preference', 'topic_score'), ints=('preference', 'topic_score')):
+        if not email in reviewer_ids:
+            reviewer_ids[email] = len(parsed.reviewers)
+            parsed.reviewers.append((first_name, last_name, email))
+        parsed.bid_reviewer.append(reviewer_ids[email])
+        parsed.bid_paper.append(paper_ids.get(paper_id, -1))
+        parsed.bid_preference.append(preference)
+        parsed.bid_topic_score.append(topic_score)
+    return parsed
+
+def load_cycle(cycle, authors_csv_filename, allpref_csv_filename, cache_dir=None):
+    if cache_dir == None:
+        return read_cycle(cycle, authors_csv_filename, allpref_csv_filename)
+    # key the cache on the content of both exports, not their names or timestamps
+    key = hashlib.sha256('{}\0{}\0'.format(CACHE_VERSION, cycle).encode())
+    for filename in (authors_csv_filename, allpref_csv_filename):
+        if is_api(filename):
+            key.update(export_bytes(filename))
+        else:
+            with open(filename, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    key.update(block)
+        key.update(b'\0')
+    cache_file = os.path.join(cache_dir, key.hexdigest()+'.cycle')
+    if os.path.exists(cache_file):
+        # only plain data is cached, a Cycle pickled as __main__.Cycle could not be loaded by importers
+        try:
+            with open(cache_file, 'rb') as f:
+                parsed = Cycle(cycle)
+                parsed.__dict__.update(pickle.load(f))
+                return parsed
+        except Exception as e:
+            print('Ignoring unreadable cache entry {}: {}: {}'.format(cache_file, type(e).__name__, e), file=sys.stderr)
+    parsed = read_cycle(cycle, authors_csv_filename, allpref_csv_filename)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(cache_file+'.tmp', 'wb') as f:
+        pickle.dump(vars(parsed), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(cache_file+'.tmp', cache_file)
+    return parsed
+
 class Conference:
     def __init__(self, year, name):
         self.year = year
@@ -15,65 +114,65 @@ class Conference:
         self.num_papers = {}     # map each author email to number of submissions
         self.paper_authors = {}  # map each paper id to a list of author emails
         self.reviewers = {}      # map each reviewer email to Reviewer object
-        
-    def add_one_cycle(self, cycle, authors_csv_filename, allpref_csv_filename):
-        # read from the csv file containing all authors
-        with open(authors_csv_filename, 'r', encoding="utf8") as f:
-            papers_csv = csv.reader(f)
-            paper_id = 0
-            for row in papers_csv:
-                if row[0] == 'paper':
-                    # header line; skip.  The assertion below is our assumption; but one coud use different field names
-                    # assert(row[1] == 'title' and row[2] == 'first' and row[3] == 'last' and row[4] == 'email')
-                    continue
-                paper_id = cycle+row[0]
-                first_name, last_name, email = row[2], row[3], row[4]
-                
-               
-                # Add author full information when seeing the author for the first time
-                author_full_name = '{} {}'.format(first_name, last_name)
-                if email == "":
-                    #print(author_full)
-                    continue
-
-                if not email in self.author_names:
-                    self.author_names[email] = author_full_name
-                
-                # Add author email to the list associated with the paper_id
-                if paper_id in self.paper_authors:
-                    self.paper_authors[paper_id].append(email)
-                else:
-                    self.paper_authors[paper_id] = [email]
-                
-                # Count number of submissions by each author 
-                if email in self.num_papers:
-                    self.num_papers[email] += 1
+
+    def add_one_cycle(self, cycle, authors_csv_filename, allpref_csv_filename, cache_dir=None):
+        self.add_cycle(load_cycle(cycle, authors_csv_filename, allpref_csv_filename, cache_dir))
+
+    def add_cycle(self, parsed):
+        for email, author_full_name in zip(parsed.authors, parsed.author_names):
+            # Add author full information when seeing the author for the first time
+            if not email in self.author_names:
+                self.author_names[email] = author_full_name
+        papers = []
+        for p, paper_id in enumerate(parsed.papers):
+            emails = [parsed.authors[a] for a in parsed.paper_authors[parsed.paper_ptr[p]:parsed.paper_ptr[p+1]]]
+            # Add author emails to the list associated with the paper_id
+            self.paper_authors.setdefault(parsed.label+paper_id, []).extend(emails)
+            papers.append(self.paper_authors[parsed.label+paper_id])
+            # Count number of submissions by each author
+            for email in emails:
+                self.num_papers[email] = self.num_papers.get(email, 0) + 1
+
+        reviewers = []
+        for first_name, last_name, email in parsed.reviewers:
+            if not email in self.reviewers:
+                self.reviewers[email] = self.Reviewer(self, first_name, last_name, email)
+            reviewers.append(self.reviewers[email])
+        for r, p, preference, topic_score in zip(parsed.bid_reviewer, parsed.bid_paper, parsed.bid_preference, parsed.bid_topic_score):
+            reviewers[r].add_bid(papers[p] if p >= 0 else [], preference, topic_score)
+
+    def merge(self, other):
+        # add the cycles of other, all counts are sums so the order of merging does not matter
+        for email in other.author_names:
+            if not email in self.author_names:
+                self.author_names[email] = other.author_names[email]
+        for email in other.num_papers:
+            self.num_papers[email] = self.num_papers.get(email, 0) + other.num_papers[email]
+        for paper_id in other.paper_authors:
+            self.paper_authors.setdefault(paper_id, []).extend(other.paper_authors[paper_id])
+        for email in other.reviewers:
+            theirs = other.reviewers[email]
+            if not email in self.reviewers:
+                theirs.conf = self
+                self.reviewers[email] = theirs
+                continue
+            mine = self.reviewers[email]
+            mine.pos_bid_num += theirs.pos_bid_num
+            mine.pos_pref_sum += theirs.pos_pref_sum
+            for author in theirs.bid_per_author:
+                if author in mine.bid_per_author:
+                    mine.bid_per_author[author][0] += theirs.bid_per_author[author][0]
+                    mine.bid_per_author[author][1] += theirs.bid_per_author[author][1]
                 else:
-                    self.num_papers[email] = 1
-
-        # read from the csv file containing all preferences
-        with open(allpref_csv_filename, 'r', encoding="utf8") as f:
-            allprefs_csv = csv.reader(f)
-            for row in allprefs_csv:
-                if row[0] == 'paper':
-                    # head line, skip. We assume the following data format
-                    # assert(row[2] == 'given_name' and row[3] == 'family_name' and row[4] == 'email' and row[6] == 'preference' and row[7] == 'topic_score')
-                    continue
-                paper_id = cycle+row[0]
-                first_name, last_name, email = row[2], row[3], row[4]
-                if not email in self.reviewers:
-                    self.reviewers[email] = self.Reviewer(self, first_name, last_name, email)
-                preference = int(row[6]) if row[6] != '' else 0
-                topic_score = int(row[7]) if row[7] != '' else 0
-                self.reviewers[email].add_bid(self.paper_authors[paper_id], preference, topic_score)
-                
+                    mine.bid_per_author[author] = theirs.bid_per_author[author]
+
     def gen_report(self):
         bai_table = []
         for reviewer in self.reviewers:
             self.reviewers[reviewer].report(bai_table)
         bai_table.sort(reverse = True)
         return bai_table
-        
+
     class Reviewer:
         def __init__(self, conf, first_name, last_name, email):
             self.conf = conf
@@ -82,9 +181,9 @@ class Conference:
             self.pos_bid_num = 0
             self.pos_pref_sum = 0
             self.bid_per_author = {}    # map each author email to (count, sum_pref)
-            
+
         def add_bid(self, paper_authors, preference, topic_score):
-            if preference >= 5:         # significant positive bids
+            if preference >= MIN_POSITIVE_PREFERENCE:         # significant positive bids
                 self.pos_bid_num += 1
                 self.pos_pref_sum += preference
                 for author in paper_authors:
@@ -93,39 +192,67 @@ class Conference:
                         self.bid_per_author[author][1] += preference
                     else:
                         self.bid_per_author[author] = [1, preference]
-        
+
         def report(self, bai_table):
             for author in self.bid_per_author:
                 [num, pref] = self.bid_per_author[author]
                 bai = pref / self.pos_pref_sum              # what fraction of reviewer's bid go to the author
                 frac = num / self.conf.num_papers[author]    # what fraction of the authors' papers is bid
-                if  num >= 3 or (num>=2 and frac>=0.5):
+                if  num >= MIN_AUTHOR_BIDS or (num >= MIN_AUTHOR_BIDS_FRACTION[0] and frac >= MIN_AUTHOR_BIDS_FRACTION[1]):
                     bai_table.append([num, bai, self.pos_bid_num, self.pos_pref_sum, self.email, self.full_name, author, self.conf.author_names[author], self.conf.num_papers[author]])
 
+def read_manifest(manifest_file):
+    # rows of conference, year, cycle, authors CSV, allprefs CSV; paths are relative to the manifest,
+    # hotcrp:authors and hotcrp:allprefs read the running cycle from the HotCRP site
+    base = os.path.dirname(manifest_file)
+    entries = []
+    with open(manifest_file, 'r', encoding="utf8") as f:
+        for row in csv.DictReader(f):
+            authors, allprefs = [source if is_api(source) else os.path.join(base, source) for source in (row['authors'], row['allprefs'])]
+            entries.append((row['conference'], row['year'], row['cycle'], authors, allprefs))
+    return entries
+
+def cycle_conference(entry):
+    # parse one manifest entry into its own Conference, runs in a worker process
+    name, year, cycle, authors_csv_filename, allpref_csv_filename, cache_dir = entry
+    conference = Conference(year, name)
+    # prefix paper ids so that cycles of different venues cannot collide
+    conference.add_one_cycle('{}{}-{}-'.format(name, year, cycle), authors_csv_filename, allpref_csv_filename, cache_dir)
+    return conference
+
+def load_manifest(manifest_file, workers=1, cache_dir=None):
+    entries = [entry + (cache_dir,) for entry in read_manifest(manifest_file)]
+    # fetched once here, the workers inherit the exports
+    prefetch([entry[3] for entry in entries] + [entry[4] for entry in entries])
+    conference = Conference(', '.join(sorted(set(entry[1] for entry in entries))), ', '.join(sorted(set(entry[0] for entry in entries))))
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            for partial in pool.imap(cycle_conference, entries):
+                conference.merge(partial)
+    else:
+        for entry in entries:
+            conference.merge(cycle_conference(entry))
+    return conference
+
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print('Run the script with: python3 {} output_file_name'.format(sys.argv[0]))
+    workers = instrument.pop_workers(sys.argv)
+    cache = instrument.pop_option(sys.argv, '--cache', '.bai-cache')
+    cache_dir = cache if cache != 'none' else None
+    timers = instrument.pop_profile(sys.argv)
+    if len(sys.argv) != 3 or workers < 1 or cache == None:
+        print('Run the script with: python3 {} [-j workers] [--cache dir|none] [--profile timings.json|stats.prof] manifest.csv output_file_name'.format(sys.argv[0]))
         exit(1)
-    conference = Conference(2024, "NDSS")
-    files = [ ["summer", "data/ndss24-summer-authors.csv", "data/ndss24-summer-allprefs.csv"],
-              ["fall", "data/ndss24-fall-authors.csv", "data/ndss24-fall-allprefs.csv"], ]
-
-    '''
-    conference = Conference(2024, "CCS")
-    files = [ ["a", "data\\ccs2024a-authors.csv", "data\\ccs2024a-allprefs.csv"],
-              ["b", "data\\ccs2024b-authors.csv", "data\\ccs2024b-allprefs.csv"], ]
-    '''
-    
-    for [cycle, paper_file, pref_file] in files:
-        conference.add_one_cycle(cycle, paper_file, pref_file)
-
-    bai_table = conference.gen_report()
-
-    with open(sys.argv[1], 'w', encoding="utf8", newline='') as file:
+
+    with timers.stage('load cycles'):
+        conference = load_manifest(sys.argv[1], workers, cache_dir)
+    with timers.stage('report'):
+        bai_table = conference.gen_report()
+
+    with open(sys.argv[2], 'w', encoding="utf8", newline='') as file:
         writer = csv.writer(file)
         writer.writerows(bai_table)
+    timers.finish()
 
     #for bai in bai_table:
     #    print(bai[0], ",", bai[1], ",", bai[2], ",", bai[3], ",", bai[4], ",", bai[5], ",", bai[6], ",", bai[7], ",", bai[8])
-    
\ No newline at end of file
@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+'''
+The goal of this script is to find missed conflicts before reviews are assigned: every PC member
+is checked against every submission, not only the pairs in the scores export.
+Two sparse matrices are multiplied into the full reviewer x paper conflict matrix:
+- reviewer x author, weighted by how recent the coauthorship is (1 = five years ago, 6 = this year)
+- author x paper, from the HotCRP authors export
+The result is a HotCRP bulk assignment file that marks the conflicts and a per-pair evidence file.
+Run after find_coauthors.py with its coauthor store and Paper Information/Authors (CSV).
+'''
+import csv
+import sys
+
+import numpy as np
+import scipy.sparse as sp
+
+from check_reviews import get_papers
+from coauthor_store import CoauthorStore, index_reviewers
+from hotcrp import prefetch
+import instrument
+
+EVIDENCE_FIELDS = ['paper', 'title', 'reviewer', 'email', 'score', 'author', 'year']
+
+def author_paper_matrix(papers):
+    # map each author name to a row and each paper to a column
+    author_ids = {}
+    paper_ids = list(papers)
+    rows = []
+    cols = []
+    for col, paper_id in enumerate(paper_ids):
+        for author in papers[paper_id].authors:
+            rows.append(author_ids.setdefault(author, len(author_ids)))
+            cols.append(col)
+    matrix = sp.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=(len(author_ids), len(paper_ids)))
+    # an author listed twice on a paper counts once
+    matrix.data[:] = 1
+    return matrix, author_ids, paper_ids
+
+def reviewer_author_matrix(by_email, author_ids, current_year):
+    # only coauthors that submitted a paper can contribute to a conflict
+    emails = list(by_email)
+    rows = []
+    cols = []
+    weights = []
+    for row, email in enumerate(emails):
+        reviewer, coauthor_years = by_email[email]
+        for author in coauthor_years:
+            if author in author_ids:
+                rows.append(row)
+                cols.append(author_ids[author])
+                weights.append(max(coauthor_years[author]) - (current_year - 6))
+    matrix = sp.csr_matrix((np.array(weights, dtype=np.int32), (rows, cols)), shape=(len(emails), len(author_ids)))
+    return matrix, emails
+
+def conflict_matrix(papers, by_email, current_year):
+    '''Returns a list of (score, email, paper id, evidence) for all conflicted reviewer/paper pairs,
+    evidence lists (author, most recent year) per shared coauthor.'''
+    authors, author_ids, paper_ids = author_paper_matrix(papers)
+    coauthors, emails = reviewer_author_matrix(by_email, author_ids, current_year)
+    conflicts = (coauthors @ authors).tocoo()
+
+    results = []
+    for row, col, score in zip(conflicts.row, conflicts.col, conflicts.data):
+        paper = papers[paper_ids[col]]
+        reviewer, coauthor_years = by_email[emails[row]]
+        evidence = []
+        for author in paper.authors:
+            if author in coauthor_years and (author, max(coauthor_years[author])) not in evidence:
+                evidence.append((author, max(coauthor_years[author])))
+        results.append((int(score), emails[row], paper.num, evidence))
+    results.sort(key=lambda result: (-result[0], result[2], result[1]))
+    return results
+
+def write_conflicts(results, papers, by_email, upload_file, evidence_file):
+    with open(upload_file, 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['paper', 'action', 'email', 'conflicttype'])
+        for score, email, paper_id, evidence in results:
+            writer.writerow([paper_id, 'conflict', email, 'collaborator'])
+    with open(evidence_file, 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(EVIDENCE_FIELDS)
+        for score, email, paper_id, evidence in results:
+            for author, year in evidence:
+                writer.writerow([paper_id, papers[paper_id].title, by_email[email][0], email, score, author, year])
+
+
+if __name__ == '__main__':
+    timers = instrument.pop_profile(sys.argv)
+    if len(sys.argv) != 3 and len(sys.argv) != 4:
+        print('Find conflicts between all PC members and all submissions. Run the script with: python3 {} [--profile timings.json|stats.prof] hotcrp-users-mapped.db hotcrp-authors.csv [conflicts-upload.csv]'.format(sys.argv[0]))
+        exit(1)
+    with timers.stage('read inputs'):
+        store = CoauthorStore(sys.argv[1])
+        prefetch(sys.argv[2:3])
+        papers = get_papers(sys.argv[2], store.aliases())
+        by_email = index_reviewers(store)
+
+    with timers.stage('conflict matrix'):
+        results = conflict_matrix(papers, by_email, store.year)
+    for score, email, paper_id, evidence in results:
+        print('Possible conflict: {} and paper {} share {} (score {})'.format(by_email[email][0], paper_id, ', '.join('{} in {}'.format(author, year) for author, year in evidence), score))
+
+    upload_file = sys.argv[3] if len(sys.argv) == 4 else 'conflicts-upload.csv'
+    write_conflicts(results, papers, by_email, upload_file, upload_file[:-4]+'-evidence.csv')
+    timers.finish()
@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+'''
+The goal of this script is to keep the coauthor store and the submissions in memory and answer
+conflict queries in milliseconds, instead of reloading everything for each run of check_reviews.py.
+It serves JSON on localhost:
+- GET /paper?id=X: conflicts of all reviewers with paper X
+- GET /reviewer?email=Y: conflicts of reviewer Y with all papers
+- POST /check with {"pairs": [[paper, email], ...]}: conflicts of the given pairs, e.g. the scores export
+- GET /summary: the per-reviewer coauthor counts that check_reviews.py prints
+- GET /status: what is loaded and when
+Every answer has the conflicts in the check_reviews.py report format and the messages it would print.
+The store and the authors export are reloaded when their files change, e.g. after find_coauthors.py
+reruns; if a reload fails the previous data keeps being served.
+`python3 check_reviews.py --server URL hotcrp-scores.csv` is the matching client. Like
+check_reviews.py the server only needs numpy and scipy for --hops.
+'''
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import os
+import sys
+import time
+from urllib.parse import urlparse, parse_qs
+import urllib.request
+
+from check_reviews import check_pairs, get_papers, indirect_conflicts, summary_lines
+from coauthor_store import CoauthorStore, index_reviewers
+from hotcrp import is_api
+import instrument
+
+DEFAULT_PORT = 8642
+
+def file_version(filename):
+    # changes whenever the file is rewritten
+    info = os.stat(filename)
+    return (info.st_mtime_ns, info.st_size)
+
+class ConflictData():
+    def __init__(self, store_file, authors_csv, index_dir=None, hops=1):
+        self.store_file = store_file
+        self.authors_csv = authors_csv
+        self.index_dir = index_dir
+        self.hops = hops
+        self.version = None
+        self.loaded = None
+        self.reload()
+
+    def files(self):
+        # an export fetched from HotCRP is not watched
+        files = [self.store_file] + ([self.authors_csv] if not is_api(self.authors_csv) else [])
+        if self.index_dir != None:
+            files.append(os.path.join(self.index_dir, 'meta.json'))
+        return files
+
+    def reload(self):
+        version = [file_version(filename) for filename in self.files()]
+        start = time.perf_counter()
+        store = CoauthorStore(self.store_file)
+        try:
+            papers = get_papers(self.authors_csv, store.aliases())
+            # every reviewer is queried sooner or later, load them all once
+            reviewers = index_reviewers(store)
+            indirect = indirect_conflicts(store, papers, self.index_dir, self.hops) if self.hops > 1 else {}
+            summary = summary_lines(store)
+        finally:
+            store.close()
+        self.papers, self.reviewers, self.indirect, self.summary = papers, reviewers, indirect, summary
+        self.version = version
+        self.loaded = datetime.now()
+        print('Loaded {} reviewers and {} papers in {:.2f}s'.format(len(reviewers), len(papers), time.perf_counter() - start), file=sys.stderr, flush=True)
+
+    def refresh(self):
+        # called before each query, a half written file fails to load and is retried on the next query
+        try:
+            if [file_version(filename) for filename in self.files()] != self.version:
+                self.reload()
+        except Exception as e:
+            print('Reload failed, serving the previous data: {}: {}'.format(type(e).__name__, e), file=sys.stderr, flush=True)
+
+    def check(self, pairs):
+        messages = []
+        conflicts = check_pairs(pairs, self.papers, self.reviewers, self.indirect, messages.append)
+        return {'conflicts': conflicts, 'messages': messages}
+
+    def paper(self, paper_id):
+        if paper_id not in self.papers:
+            return None
+        return self.check([(paper_id, email) for email in self.reviewers])
+
+    def reviewer(self, email):
+        if email not in self.reviewers:
+            return None
+        return self.check([(paper_id, email) for paper_id in self.papers])
+
+    def status(self):
+        return {'store': self.store_file, 'authors': self.authors_csv, 'hops': self.hops,
+                'reviewers': len(self.reviewers), 'papers': len(self.papers),
+                'loaded': self.loaded.isoformat(timespec='seconds')}
+
+class Handler(BaseHTTPRequestHandler):
+    # the server handles one query at a time, so reloads never race with queries
+    def do_GET(self):
+        url = urlparse(self.path)
+        args = {key: values[0] for key, values in parse_qs(url.query).items()}
+        data = self.server.data
+        data.refresh()
+        if url.path == '/paper' and 'id' in args:
+            self.answer(data.paper(args['id']), 'no paper {}'.format(args['id']))
+        elif url.path == '/reviewer' and 'email' in args:
+            self.answer(data.reviewer(args['email']), 'no reviewer {}'.format(args['email']))
+        elif url.path == '/summary':
+            self.answer({'summary': data.summary})
+        elif url.path == '/status':
+            self.answer(data.status())
+        else:
+            self.answer(None, 'unknown query {}'.format(self.path))
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/check':
+            self.answer(None, 'unknown query {}'.format(self.path))
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            pairs = [(str(paper_id), email) for paper_id, email in request['pairs']]
+        except (ValueError, KeyError, TypeError) as e:
+            self.answer(None, 'bad request: {}'.format(e), 400)
+            return
+        self.server.data.refresh()
+        self.answer(self.server.data.check(pairs))
+
+    def answer(self, result, error=None, status=404):
+        if result == None:
+            result = {'error': error}
+        else:
+            status = 200
+        body = json.dumps(result).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # keep stdout clean, one line per query on stderr
+        print('{} {}'.format(self.address_string(), format % args), file=sys.stderr, flush=True)
+
+def query(server, path, payload=None):
+    # client side: GET path, or POST payload as JSON
+    body = json.dumps(payload).encode('utf8') if payload != None else None
+    request = urllib.request.Request(server.rstrip('/') + path, data=body, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)
+
+def serve(data, host='127.0.0.1', port=DEFAULT_PORT):
+    server = HTTPServer((host, port), Handler)
+    server.data = data
+    print('Serving conflict queries on http://{}:{}'.format(host, server.server_port), file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == '__main__':
+    timers = instrument.pop_profile(sys.argv)
+    port = instrument.parse_number(instrument.pop_option(sys.argv, '--port', DEFAULT_PORT), int, 0)
+    # optional transitive conflicts as in check_reviews.py: --hops K dblp-index
+    hops, index_dir = instrument.pop_option(sys.argv, '--hops', (1, None), 2) or (None, None)
+    hops = instrument.parse_number(hops)
+    if len(sys.argv) != 3 or port == None or hops == None:
+        print('Serve conflict queries from memory. Run the script with: python3 {} [--port {}] [--hops K dblp-index] [--profile timings.json|stats.prof] hotcrp-users-mapped.db hotcrp-authors.csv'.format(sys.argv[0], DEFAULT_PORT))
+        exit(1)
+    with timers.stage('load'):
+        data = ConflictData(sys.argv[1], sys.argv[2], index_dir, hops)
+    # the queries until the server is stopped, including reloads
+    with timers.stage('serve'):
+        serve(data, port=port)
+    timers.finish()
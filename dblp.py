@@ -0,0 +1,274 @@
+#!/usr/bin/python3
+'''
+Shared helpers to stream publication records out of the DBLP dump (dblp.xml.gz).
+
+Records are either parsed sequentially with lxml (iter_records) or in parallel (map_records): a
+thread inflates the dump into blocks, the blocks are cut on top-level record boundaries and a
+process pool parses the batches and runs a handler on them. Handlers return partial results
+that the caller merges in DBLP order, so both modes produce the same output.
+
+Both modes accept a since date: records with an older mdate are skipped before full parsing and
+returned as stubs without authors. Records of the since day itself are parsed again, an edit made
+later on the day of the last snapshot carries the same mdate.
+
+Person (www homepages) records list every name DBLP knows for one person, the first one is the
+name DBLP shows. Aliases collects them so that each name resolves to that canonical name.
+'''
+import lxml.etree as ET
+from gzip import GzipFile
+import multiprocessing
+import os
+import queue
+import re
+import threading
+
+# every publication type of DBLP, www records describe persons
+PUB_TAGS = ('inproceedings', 'article', 'incollection', 'proceedings', 'book', 'phdthesis', 'mastersthesis', 'data')
+RECORD_TAGS = ('article', 'inproceedings', 'proceedings', 'book', 'incollection', 'phdthesis', 'mastersthesis', 'www', 'data')
+PERSON_TAGS = ('author', 'editor') # editors of proceedings and books count like authors
+ORCID_RE = re.compile(r'(\d{4}-\d{4}-\d{4}-\d{3}[\dX])')
+
+BLOCK_SIZE = 4*1024*1024 # bytes of decompressed XML handed to a worker at a time
+RECORD_START_RE = re.compile(rb'<(?:' + b'|'.join(tag.encode() for tag in RECORD_TAGS) + rb')[\s>]')
+ROOT_RE = re.compile(rb'<dblp[\s>]')
+XML_DECL_RE = re.compile(rb'<\?xml[^>]*\?>')
+DOCTYPE_RE = re.compile(rb'<!DOCTYPE\s+\w+\s+SYSTEM\s+"([^"]+)"')
+ENTITY_DECL_RE = re.compile(rb'<!ENTITY\s+(\w+)\s+"([^"]*)"\s*>')
+ENTITY_REF_RE = re.compile(rb'&(\w+);')
+RECORD_LINE_RE = re.compile(rb'^<(' + b'|'.join(tag.encode() for tag in RECORD_TAGS) + rb')[\s>]', re.M)
+KEY_RE = re.compile(rb'\skey="([^"]*)"')
+MDATE_RE = re.compile(rb'\smdate="([^"]*)"')
+
+class Record():
+    def __init__(self, tag, key, mdate, year, authors, orcids):
+        self.tag = tag
+        self.key = key
+        self.mdate = mdate # date of the last modification of the record in DBLP
+        self.year = year
+        self.authors = authors
+        self.orcids = orcids # map author name -> ORCID where DBLP knows it
+
+def normalize_orcid(orcid):
+    # accept both bare ORCIDs and https://orcid.org/... URLs
+    match = ORCID_RE.search(orcid) if orcid != None else None
+    return match.group(1) if match != None else ''
+
+def element_record(elem):
+    authors = []
+    orcids = {}
+    urls = []
+    year = 0
+    for child in elem.iter():
+        if child.tag in PERSON_TAGS:
+            if child.text != None:
+                authors.append(child.text)
+                if child.get('orcid') != None:
+                    orcids[child.text] = normalize_orcid(child.get('orcid'))
+        elif child.tag == 'url' and elem.tag == 'www':
+            urls.append(child.text)
+        elif child.tag == 'year' and elem.tag in PUB_TAGS:
+            year = int(child.text)
+    if elem.tag == 'www':
+        # person records list all names of one person, an ORCID URL applies to each of them
+        for url in urls:
+            orcid = normalize_orcid(url) if url != None and 'orcid.org' in url else ''
+            if orcid != '':
+                for author in authors:
+                    orcids.setdefault(author, orcid)
+    return Record(elem.tag, elem.get('key'), elem.get('mdate'), year, authors, orcids)
+
+def person_names(record):
+    # all names of a person with aliases, the canonical one first; other www records have no aliases
+    if record.tag == 'www' and record.key != None and record.key.startswith('homepages/') and len(record.authors) > 1:
+        return record.authors
+    return []
+
+class Aliases():
+    # map every name of a person with aliases to the canonical name, homonyms ("Jane Doe 0002") are different persons
+    def __init__(self, persons=()):
+        self.canonical = {}
+        self.names = {} # canonical name -> all names
+        for names in persons:
+            self.add(names)
+
+    def add(self, names):
+        for name in names:
+            self.canonical.setdefault(name, names[0])
+        self.names[names[0]] = list(names)
+
+    def resolve(self, name):
+        return self.canonical.get(name, name)
+
+    def names_of(self, name):
+        return self.names.get(self.resolve(name), [name])
+
+def collect_records(records, context):
+    return list(records)
+
+def wanted(tag):
+    return tag in PUB_TAGS or tag == 'www'
+
+def iter_records(dblp_file, workers=1, since=None, progress=None):
+    # progress is an optional instrument.Progress that is updated as records are read
+    if workers > 1:
+        for records in map_records(dblp_file, collect_records, None, workers, since=since, progress=progress):
+            yield from records
+        return
+    if since != None:
+        # cut the dump into batches like the workers do, so unchanged records are not parsed
+        batches, decl, entities = open_batches(dblp_file, BLOCK_SIZE, progress)
+        for batch in batches:
+            for record in parse_batch(batch, decl, entities, since):
+                if progress != None:
+                    progress.tick(1, record.year)
+                yield record
+        return
+    dblp_stream = GzipFile(filename=dblp_file)
+    if progress != None:
+        progress.measure = lambda: (dblp_stream.fileobj.tell(), dblp_stream.tell())
+    # only record ends are reported; fields are read from the finished record
+    for event, elem in ET.iterparse(dblp_stream, events = ('end',), tag = RECORD_TAGS, load_dtd = True):
+        if wanted(elem.tag):
+            record = element_record(elem)
+            if progress != None:
+                progress.tick(1, record.year)
+            yield record
+        # free the record and the already processed records before it, so memory stays flat
+        elem.clear(keep_tail=True)
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+def read_blocks(dblp_file, block_size, progress=None):
+    # decompression stage, runs in its own thread as zlib releases the GIL while inflating
+    blocks = queue.Queue(maxsize=4)
+    def inflate():
+        try:
+            with GzipFile(filename=dblp_file) as f:
+                while True:
+                    block = f.read(block_size)
+                    if progress != None:
+                        progress.bytes_in = f.fileobj.tell()
+                        progress.bytes_out += len(block)
+                    blocks.put(block)
+                    if len(block) == 0:
+                        break
+        except Exception as e:
+            blocks.put(e)
+    threading.Thread(target=inflate, daemon=True).start()
+    while True:
+        block = blocks.get()
+        if isinstance(block, Exception):
+            raise block
+        if len(block) == 0:
+            return
+        yield block
+
+def _last_record_start(buf):
+    # records start on their own line, return the offset of the last one (0 if there is none)
+    pos = len(buf)
+    while True:
+        pos = buf.rfind(b'\n<', 0, pos)
+        if pos < 0:
+            return 0
+        if RECORD_START_RE.match(buf, pos+1):
+            return pos+1
+
+def split_records(blocks):
+    '''Yield the XML prolog, then batches of complete top-level records.'''
+    buf = b''
+    prolog = None
+    for block in blocks:
+        buf += block
+        if prolog == None:
+            root = ROOT_RE.search(buf)
+            if root == None:
+                continue
+            prolog = buf[:root.start()]
+            yield prolog
+            buf = buf[buf.index(b'>', root.start())+1:]
+        cut = _last_record_start(buf)
+        if cut > 0:
+            if len(buf[:cut].strip()) != 0:
+                yield buf[:cut]
+            buf = buf[cut:]
+    if prolog == None:
+        return
+    end = buf.rfind(b'</dblp>')
+    if end >= 0:
+        buf = buf[:end]
+    if len(buf.strip()) != 0:
+        yield buf
+
+def load_entities(dtd_file):
+    # map each character entity of the DTD to its numeric reference, e.g. uuml -> &#252;
+    with open(dtd_file, 'rb') as f:
+        return {name: value for name, value in ENTITY_DECL_RE.findall(f.read())}
+
+def _fromstring(decl, batch, entities):
+    batch = ENTITY_REF_RE.sub(lambda m: entities.get(m.group(1), m.group(0)), batch)
+    root = ET.fromstring(decl + b'<dblp>' + batch + b'</dblp>')
+    return [element_record(elem) for elem in root if wanted(elem.tag)]
+
+def parse_batch(batch, decl, entities, since=None):
+    if since == None:
+        return _fromstring(decl, batch, entities)
+    # only parse records modified on or after since, the others become stubs
+    records = []
+    changed = []
+    starts = list(RECORD_LINE_RE.finditer(batch))
+    for i, start in enumerate(starts):
+        tag = start.group(1).decode()
+        if not wanted(tag):
+            continue
+        end = starts[i+1].start() if i+1 < len(starts) else len(batch)
+        head = batch[start.start():batch.index(b'>', start.start())]
+        key = KEY_RE.search(head)
+        mdate = MDATE_RE.search(head)
+        if mdate != None and mdate.group(1).decode() < since:
+            records.append(Record(tag, key.group(1).decode() if key != None else None, mdate.group(1).decode(), 0, [], {}))
+        else:
+            records.append(None)
+            changed.append(batch[start.start():end])
+    parsed = iter(_fromstring(decl, b''.join(changed), entities))
+    return [record if record != None else next(parsed) for record in records]
+
+def open_batches(dblp_file, block_size, progress=None):
+    # returns the batches of records, the XML declaration, and the character entities of the DTD
+    batches = split_records(read_blocks(dblp_file, block_size, progress))
+    prolog = next(batches, b'')
+    doctype = DOCTYPE_RE.search(prolog)
+    dtd_file = os.path.join(os.path.dirname(dblp_file), doctype.group(1).decode() if doctype != None else 'dblp.dtd')
+    entities = load_entities(dtd_file)
+    decl = XML_DECL_RE.match(prolog.lstrip())
+    decl = decl.group(0) if decl != None else b''
+    return batches, decl, entities
+
+_worker = None
+
+def _init_worker(handler, context, entities, decl, since):
+    global _worker
+    _worker = (handler, context, entities, decl, since)
+
+def _map_batch(batch):
+    handler, context, entities, decl, since = _worker
+    records = parse_batch(batch, decl, entities, since)
+    # the number of records and the last year are only for progress reports
+    return len(records), records[-1].year if len(records) > 0 else None, handler(records, context)
+
+def map_records(dblp_file, handler, context, workers, block_size=BLOCK_SIZE, since=None, progress=None):
+    '''Run handler(records, context) over batches of records in a pool of worker processes and
+    yield the partial results in DBLP order.  handler and context must be picklable.'''
+    batches, decl, entities = open_batches(dblp_file, block_size, progress)
+
+    # bound the number of batches in flight, the pool would otherwise inflate the whole dump into memory
+    inflight = threading.Semaphore(2*workers)
+    def throttled():
+        for batch in batches:
+            inflight.acquire()
+            yield batch
+    with multiprocessing.Pool(workers, _init_worker, (handler, context, entities, decl, since)) as pool:
+        for count, year, partial in pool.imap(_map_batch, throttled()):
+            inflight.release()
+            if progress != None:
+                progress.tick(count, year)
+            yield partial
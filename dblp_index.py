@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+'''
+The goal of this script is to parse dblp.xml.gz once and store the coauthor graph in a compact
+on-disk index that match_reviewers_dblp.py and find_coauthors.py can load instead of reparsing.
+Rebuild the index whenever you download a new DBLP snapshot.
+
+Index layout (one directory, all integers are native-endian uint32):
+- meta.json: format version and table sizes
+- names.txt: one DBLP author name per line, the line number is the author id
+- pub_year.bin (uint16), pub_type.bin (uint8): one entry per publication, in DBLP order
+- pub_ptr.bin, pub_authors.bin: CSR publication -> author ids
+- author_ptr.bin, author_pubs.bin: CSR author -> publication ids
+- coauthor_ptr.bin, coauthors.bin: CSR author -> sorted coauthor ids
+- orcids.txt: one "ORCID<tab>author id" line per DBLP name with a known ORCID
+- aliases.txt: one line of tab separated author ids per person with several names, canonical first
+'''
+from array import array
+from datetime import datetime
+import json
+import mmap
+import os
+import sys
+
+import dblp
+import instrument
+
+INDEX_VERSION = 4
+
+def build_index(dblp_file, index_dir, workers=1, progress=None):
+    names = []
+    name_ids = {} # intern each DBLP name once
+    pub_year = array('H')
+    pub_type = array('B')
+    pub_ptr = array('I', [0])
+    pub_authors = array('I')
+    orcids = {} # map DBLP name -> ORCID
+    persons = [] # names of each person with aliases
+
+    for record in dblp.iter_records(dblp_file, workers, progress=progress):
+        orcids.update(record.orcids)
+        if len(dblp.person_names(record)) > 0:
+            persons.append(dblp.person_names(record))
+        if record.tag not in dblp.PUB_TAGS:
+            continue
+        for author in record.authors:
+            aid = name_ids.get(author)
+            if aid == None:
+                aid = len(names)
+                name_ids[author] = aid
+                names.append(author)
+            pub_authors.append(aid)
+        pub_ptr.append(len(pub_authors))
+        pub_year.append(record.year)
+        pub_type.append(dblp.PUB_TAGS.index(record.tag))
+        if progress != None:
+            progress.found += 1
+    # names only known from person records go last so that ids keep the order of first publication
+    def intern(author):
+        aid = name_ids.get(author)
+        if aid == None:
+            aid = len(names)
+            name_ids[author] = aid
+            names.append(author)
+        return aid
+    orcid_ids = [(orcids[author], intern(author)) for author in orcids]
+    person_ids = [[intern(author) for author in person] for person in persons]
+    name_ids = None
+
+    # invert publication -> authors into author -> publications (counting sort keeps DBLP order)
+    nr_authors = len(names)
+    author_ptr = array('I', bytes(4*(nr_authors+1)))
+    for aid in pub_authors:
+        author_ptr[aid+1] += 1
+    for aid in range(nr_authors):
+        author_ptr[aid+1] += author_ptr[aid]
+    fill = array('I', author_ptr[:-1])
+    author_pubs = array('I', bytes(4*len(pub_authors)))
+    for pid in range(len(pub_year)):
+        for i in range(pub_ptr[pid], pub_ptr[pid+1]):
+            aid = pub_authors[i]
+            author_pubs[fill[aid]] = pid
+            fill[aid] += 1
+    fill = None
+
+    coauthor_ptr = array('I', [0])
+    coauthors = array('I')
+    for aid in range(nr_authors):
+        neighbors = set()
+        for i in range(author_ptr[aid], author_ptr[aid+1]):
+            pid = author_pubs[i]
+            neighbors.update(pub_authors[pub_ptr[pid]:pub_ptr[pid+1]])
+        neighbors.discard(aid)
+        coauthors.extend(sorted(neighbors))
+        coauthor_ptr.append(len(coauthors))
+
+    os.makedirs(index_dir, exist_ok=True)
+    # caches derived from an earlier build (adjacency-*.npz) refer to its author ids
+    for filename in os.listdir(index_dir):
+        if filename.startswith('adjacency-'):
+            os.remove(os.path.join(index_dir, filename))
+    with open(os.path.join(index_dir, 'names.txt'), 'w', encoding='utf8') as f:
+        f.write('\n'.join(names))
+    with open(os.path.join(index_dir, 'orcids.txt'), 'w', encoding='utf8') as f:
+        for orcid, aid in orcid_ids:
+            f.write('{}\t{}\n'.format(orcid, aid))
+    with open(os.path.join(index_dir, 'aliases.txt'), 'w', encoding='utf8') as f:
+        for person in person_ids:
+            f.write('\t'.join(str(aid) for aid in person) + '\n')
+    tables = {'pub_year': pub_year, 'pub_type': pub_type, 'pub_ptr': pub_ptr, 'pub_authors': pub_authors,
+              'author_ptr': author_ptr, 'author_pubs': author_pubs, 'coauthor_ptr': coauthor_ptr, 'coauthors': coauthors}
+    for table in tables:
+        with open(os.path.join(index_dir, table+'.bin'), 'wb') as f:
+            tables[table].tofile(f)
+    meta = {'version': INDEX_VERSION, 'source': os.path.basename(dblp_file), 'pub_tags': list(dblp.PUB_TAGS),
+            'authors': nr_authors, 'pubs': len(pub_year), 'links': len(pub_authors), 'edges': len(coauthors), 'persons': len(person_ids),
+            'built': datetime.now().isoformat()} # tells builds apart, e.g. for the caches of transitive_conflicts.py
+    with open(os.path.join(index_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+    return meta
+
+def _map_table(path, typecode):
+    # map a table read-only into memory, the OS pages in only what we touch
+    if os.path.getsize(path) == 0:
+        return memoryview(array(typecode))
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mm).cast(typecode)
+
+class DblpIndex():
+    def __init__(self, index_dir):
+        self.path = index_dir
+        with open(os.path.join(index_dir, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        if self.meta['version'] != INDEX_VERSION:
+            raise ValueError('DBLP index {} has version {}, expected {}; rebuild it with dblp_index.py'.format(index_dir, self.meta['version'], INDEX_VERSION))
+        with open(os.path.join(index_dir, 'names.txt'), 'r', encoding='utf8') as f:
+            self.names = f.read().split('\n') if self.meta['authors'] > 0 else []
+        self.pub_tags = self.meta['pub_tags']
+        self.pub_year = _map_table(os.path.join(index_dir, 'pub_year.bin'), 'H')
+        self.pub_type = _map_table(os.path.join(index_dir, 'pub_type.bin'), 'B')
+        self.pub_ptr = _map_table(os.path.join(index_dir, 'pub_ptr.bin'), 'I')
+        self.pub_authors = _map_table(os.path.join(index_dir, 'pub_authors.bin'), 'I')
+        self.author_ptr = _map_table(os.path.join(index_dir, 'author_ptr.bin'), 'I')
+        self.author_pubs = _map_table(os.path.join(index_dir, 'author_pubs.bin'), 'I')
+        self.coauthor_ptr = _map_table(os.path.join(index_dir, 'coauthor_ptr.bin'), 'I')
+        self.coauthors = _map_table(os.path.join(index_dir, 'coauthors.bin'), 'I')
+        self.orcids = {} # map ORCID -> list of author ids
+        with open(os.path.join(index_dir, 'orcids.txt'), 'r', encoding='utf8') as f:
+            for line in f:
+                orcid, aid = line.rstrip('\n').split('\t')
+                self.orcids.setdefault(orcid, []).append(int(aid))
+        self._name_ids = None
+        self._aliases = None
+
+    def author_id(self, name):
+        # the name -> id map is only built for lookups, iterating self.names does not need it
+        if self._name_ids == None:
+            self._name_ids = {name: aid for aid, name in enumerate(self.names)}
+        return self._name_ids.get(name)
+
+    def aliases(self):
+        # dblp.Aliases of all persons with several names, loaded on first use
+        if self._aliases == None:
+            self._aliases = dblp.Aliases()
+            with open(os.path.join(self.path, 'aliases.txt'), 'r', encoding='utf8') as f:
+                for line in f:
+                    self._aliases.add([self.names[int(aid)] for aid in line.split('\t')])
+        return self._aliases
+
+    def has_pubs(self, aid):
+        return self.author_ptr[aid] != self.author_ptr[aid+1]
+
+    def pubs_of(self, aid):
+        return self.author_pubs[self.author_ptr[aid]:self.author_ptr[aid+1]]
+
+    def authors_of(self, pid):
+        return self.pub_authors[self.pub_ptr[pid]:self.pub_ptr[pid+1]]
+
+    def coauthors_of(self, aid):
+        return self.coauthors[self.coauthor_ptr[aid]:self.coauthor_ptr[aid+1]]
+
+
+if __name__ == '__main__':
+    workers = instrument.pop_workers(sys.argv)
+    timers = instrument.pop_profile(sys.argv)
+    if len(sys.argv) > 3 or workers < 1:
+        print('Build the DBLP coauthor index. Run the script with: python3 {} [-j workers] [--profile timings.json|stats.prof] [dblp.xml.gz] [dblp-index]'.format(sys.argv[0]))
+        exit(1)
+    dblp_file = sys.argv[1] if len(sys.argv) > 1 else './dblp.xml.gz'
+    index_dir = sys.argv[2] if len(sys.argv) > 2 else './dblp-index'
+    with timers.stage('build index'):
+        meta = build_index(dblp_file, index_dir, workers, instrument.Progress('dblp_index', dblp_file, 'publications'))
+    print('Indexed {} publications with {} authors and {} coauthor links into {}'.format(meta['pubs'], meta['authors'], meta['edges'], index_dir))
+    timers.finish()
@@ -2,91 +2,218 @@
 '''
 The goal of this script is to match the reviewer names and emails to the names used in DBLP
 '''
-import lxml.etree as ET
-from gzip import GzipFile
 import pickle
 import csv
+import os
 import re
 import sys
 from datetime import datetime
 
+import dblp
+import instrument
+from dblp_index import DblpIndex
+from coauthor_store import write_store
+
+STATE_VERSION = 3
+
 class Author():
-    def __init__(self, name, email, orcid, dblp):
+    def __init__(self, name, email, orcid, dblp, names):
         self.name = name
         self.email = email
         self.orcid = orcid
         self.dblp = dblp
+        self.names = names # all DBLP matches, the ones that are the same person as dblp count
         self.coauthors = {}
         current_year = datetime.now().year
         for i in range(0,6):
-            self.coauthors[current_year-i] = []
+            self.coauthors[current_year-i] = set()
 
 def load_reviewers(reviewer_file):
     reviewers = {}
     with open(reviewer_file, 'r') as f:
         reviewer_file_csv = csv.reader(f)
         for row in reviewer_file_csv:
-            aut = Author(row[0], row[1], row[2], row[3])
+            aut = Author(row[0], row[1], row[2], row[3], [name for name in row[3:] if name != ''])
             #reviewers[row[0]+' '+row[1]] = aut
             reviewers[row[3]] = aut
     return reviewers
 
-def parse_dblp(dblp_file, reviewers):
-    dblp_stream = GzipFile(filename=dblp_file)
-    authors = []
-    in_pub = False # flag marking if we're parsing a publication
-    in_www = False # flag marking if we're parsing affiliation information
-    year = 0
+def add_coauthors(reviewer, authors, year, aliases):
+    # coauthors are stored under their canonical DBLP name
+    person = aliases.resolve(reviewer.dblp)
+    for coauthor in authors:
+        coauthor = aliases.resolve(coauthor)
+        if coauthor != person:
+            reviewer.coauthors[year].add(coauthor)
+
+def reviewer_names(reviewers):
+    # every DBLP name in the mapped CSV, the publications of all of them are collected
+    return sorted(set(name for reviewer in reviewers.values() for name in reviewer.names))
+
+def new_state(current_year, names):
+    # what a DBLP pass ingested, so that the next snapshot only needs the records changed since
+    return {'version': STATE_VERSION, 'year': current_year, 'names': names,
+            'snapshot': '',   # newest mdate of the last ingested snapshot
+            'records': {},    # key -> (mdate, year, authors) of reviewer publications in the window
+            'persons': {}}    # key -> (mdate, names) of persons with aliases
+
+def load_state(state_file):
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file, 'rb') as f:
+        state = pickle.load(f)
+    return state if state['version'] == STATE_VERSION else None
+
+def coauthor_records(records, context):
+    # returns the reviewer publications in the time window and the persons with aliases that are new
+    # or changed since the last snapshot, the already ingested keys that are still in DBLP, and the
+    # newest mdate seen
+    names, current_year, since, known = context
+    found = []
+    persons = []
+    seen = []
+    snapshot = ''
+    for record in records:
+        if record.tag not in dblp.PUB_TAGS and record.tag != 'www':
+            continue
+        if record.mdate != None and record.mdate > snapshot:
+            snapshot = record.mdate
+        if record.key in known:
+            seen.append(record.key)
+        # the day of the last snapshot is processed again, ingesting a record twice changes nothing
+        if since != None and record.mdate != None and record.mdate < since:
+            continue
+        if record.tag == 'www':
+            if len(dblp.person_names(record)) > 0:
+                persons.append((record.key, record.mdate, dblp.person_names(record)))
+            elif record.key in known:
+                persons.append((record.key, record.mdate, None))
+            continue
+        if record.year >= current_year - 5 and record.year <= current_year and any(author in names for author in record.authors):
+            found.append((record.key, record.mdate, record.year, record.authors))
+        elif record.key in known:
+            # the record changed and no longer involves a reviewer in the time window
+            found.append((record.key, record.mdate, record.year, None))
+    return found, persons, seen, snapshot
+
+def state_aliases(state):
+    return dblp.Aliases(names for mdate, names in state['persons'].values())
+
+def parse_dblp(dblp_file, reviewers, workers=1, state=None, progress=None):
     current_year = datetime.now().year
-    for event, elem in ET.iterparse(dblp_stream, events = ('start', 'end',), load_dtd = True):
-        # mark header tags
-        if event == 'start':
-            if elem.tag == 'inproceedings' or elem.tag == 'article':
-                in_pub = True
-            if elem.tag == 'www':
-                in_www = True
-        # process individual closing tags
-        if event == 'end':            
-            if (in_pub or in_www) and elem.tag == 'author':
-                authors.append(elem.text)
-            elif in_pub and elem.tag == 'year':
-                year = int(elem.text)
-            elif elem.tag == 'inproceedings' or elem.tag == 'article':
+    names = reviewer_names(reviewers)
+    if state == None or state['year'] != current_year or state['names'] != names:
+        state = new_state(current_year, names)
+    since = state['snapshot'] if state['snapshot'] != '' else None
+    known = set(state['records']) | set(state['persons'])
+    context = (set(names), current_year, since, known)
+    if workers > 1:
+        partials = dblp.map_records(dblp_file, coauthor_records, context, workers, since=since, progress=progress)
+    else:
+        partials = (coauthor_records([record], context) for record in dblp.iter_records(dblp_file, since=since, progress=progress))
+
+    seen = set()
+    snapshot = ''
+    for found, persons, seen_keys, batch_snapshot in partials:
+        seen.update(seen_keys)
+        snapshot = max(snapshot, batch_snapshot)
+        if progress != None:
+            progress.found += len(found)
+        for key, mdate, year, authors in found:
+            if authors == None:
+                state['records'].pop(key, None)
+            else:
+                state['records'][key] = (mdate, year, authors)
+        for key, mdate, person in persons:
+            if person == None:
+                state['persons'].pop(key, None)
+            else:
+                state['persons'][key] = (mdate, person)
+    # records that were removed from DBLP
+    for key in known - seen:
+        state['records'].pop(key, None)
+        state['persons'].pop(key, None)
+    state['snapshot'] = snapshot
+
+    # only the matches that DBLP knows as the same person as the first one count, not homonyms
+    aliases = state_aliases(state)
+    by_name = {}
+    for reviewer in reviewers.values():
+        for name in reviewer.names:
+            if aliases.resolve(name) == aliases.resolve(reviewer.dblp):
+                by_name.setdefault(name, []).append(reviewer)
+        missing = [name for name in aliases.names_of(reviewer.dblp) if name not in reviewer.names]
+        if len(missing) > 0:
+            print('{} is also {} in DBLP, rerun match_reviewers_dblp.py to include the publications under these names'.format(reviewer.dblp, ', '.join(missing)))
+    for key in state['records']:
+        mdate, year, authors = state['records'][key]
+        for author in authors:
+            for reviewer in by_name.get(author, ()):
+                add_coauthors(reviewer, authors, year, aliases)
+    return state
+
+def parse_index(index, reviewers):
+    # only touch the publications of our reviewers instead of replaying all of DBLP,
+    # under every name DBLP knows for them
+    current_year = datetime.now().year
+    aliases = index.aliases()
+    for author in reviewers:
+        for name in aliases.names_of(author):
+            aid = index.author_id(name)
+            if aid == None:
+                continue
+            for pid in index.pubs_of(aid):
+                year = index.pub_year[pid]
                 if year >= current_year - 5 and year <= current_year:
-                    for author in authors:
-                        if author in reviewers:
-                            for coauthor in authors:
-                                if coauthor != author and coauthor not in reviewers[author].coauthors[year]:
-                                    reviewers[author].coauthors[year].append(coauthor)
-                authors = []
-                year = 0
-                in_pub = False
-            elif elem.tag == 'www':
-                authors = []
-                year = 0
-                in_www = False
-            elem.clear()
+                    add_coauthors(reviewers[author], [index.names[i] for i in index.authors_of(pid)], year, aliases)
+    return aliases
+
+def store_aliases(reviewers, aliases):
+    # map other names -> canonical name of the coauthors, so that check_reviews.py can resolve
+    # submitting authors that use another name
+    persons = set()
+    for reviewer in reviewers.values():
+        for year in reviewer.coauthors:
+            persons.update(reviewer.coauthors[year])
+    return {name: person for person in sorted(persons) for name in aliases.names_of(person) if name != person}
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2 and len(sys.argv) != 3:
-        print('Find coauthors of mapped HotCRP reviewers. Run the script with: python3 {} hotcrp-users-mapped.csv [dblp.xml.gz]'.format(sys.argv[0]))
+    workers = instrument.pop_workers(sys.argv)
+    refresh = '--refresh' in sys.argv
+    if refresh:
+        sys.argv.remove('--refresh')
+    timers = instrument.pop_profile(sys.argv)
+    if (len(sys.argv) != 2 and len(sys.argv) != 3) or workers < 1:
+        print('Find coauthors of mapped HotCRP reviewers. Run the script with: python3 {} [-j workers] [--refresh] [--profile timings.json|stats.prof] hotcrp-users-mapped.csv [dblp.xml.gz|dblp-index]'.format(sys.argv[0]))
         exit(1)
     # Parse reviewers from HotCRP CSV
-    reviewers = load_reviewers(sys.argv[1])
+    with timers.stage('read reviewers'):
+        reviewers = load_reviewers(sys.argv[1])
 
     if len(sys.argv) == 2:
         dblp_file = './dblp.xml.gz'
     else:
         dblp_file = sys.argv[2]
-    parse_dblp(dblp_file, reviewers)
+    if os.path.isdir(dblp_file):
+        with timers.stage('coauthors from index'):
+            aliases = parse_index(DblpIndex(dblp_file), reviewers)
+    else:
+        # remember what we ingested, a later --refresh on a new snapshot only processes what changed
+        state_file = sys.argv[1][:-4]+'-refresh.pickle'
+        with timers.stage('coauthors from dblp'):
+            state = parse_dblp(dblp_file, reviewers, workers, load_state(state_file) if refresh else None, instrument.Progress('find_coauthors', dblp_file, 'reviewer publications'))
+        with timers.stage('write refresh state'):
+            with open(state_file, 'wb') as f:
+                pickle.dump(state, f)
+        aliases = state_aliases(state)
 
     current_year = datetime.now().year
     for reviewer in reviewers:
         print('{} -> {} {} {} {} {} {}'.format(reviewer, len(reviewers[reviewer].coauthors[current_year]), len(reviewers[reviewer].coauthors[current_year-1]), len(reviewers[reviewer].coauthors[current_year-2]), len(reviewers[reviewer].coauthors[current_year-3]), len(reviewers[reviewer].coauthors[current_year-4]), len(reviewers[reviewer].coauthors[current_year-5])))
 
 
-    with open(sys.argv[1][:-4]+'.pickle', 'wb') as f:
-        pickle.dump(reviewers, f)
-        f.close()
+    with timers.stage('write store'):
+        write_store(sys.argv[1][:-4]+'.db', reviewers.values(), current_year, store_aliases(reviewers, aliases))
+    timers.finish()
 
@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+'''
+Shared loader for the HotCRP CSV exports used by the scripts:
+- Paper Information/Authors: paper,title,first,last,email,affiliation,...
+- Reviews/Scores: paper,title,...,email,...
+- allprefs: paper,title,given_name,family_name,email,affiliation,preference,topic_score,...
+- Users/Names and emails: given_name,family_name,email,affiliation,country,orcid,...
+Columns are looked up by their header name, so reordered or extended exports still work.
+Instead of a file name, every loader also takes hotcrp:users, hotcrp:authors, hotcrp:scores, or
+hotcrp:allprefs to read the export straight from the HotCRP site, see hotcrp_api.py.
+read_export streams rows as tuples, interns repeated strings (paper ids, names, emails) so each
+distinct value is stored once, and converts numeric columns to integers ('' counts as 0).
+read_columns is the columnar fast path for large exports such as allprefs: whole columns go
+straight into NumPy arrays and strings are replaced by integer codes.
+'''
+from array import array
+import csv
+import io
+import itertools
+from operator import itemgetter
+
+CHUNK_ROWS = 1024 # rows converted at once by read_columns
+
+# HotCRP names the same column differently in different exports
+ALIASES = {
+    'first': ('given_name',),
+    'given_name': ('first',),
+    'last': ('family_name',),
+    'family_name': ('last',),
+}
+
+API_PREFIX = 'hotcrp:'
+
+def is_api(source):
+    return source.startswith(API_PREFIX)
+
+def export_name(source):
+    # the file name an export has when downloaded by hand, for naming derived files
+    return 'hotcrp-{}.csv'.format(source[len(API_PREFIX):]) if is_api(source) else source
+
+def prefetch(sources):
+    '''Fetch all hotcrp: exports among sources at once, so the loaders do not fetch them one by one.'''
+    if any(is_api(source) for source in sources):
+        import hotcrp_api
+        hotcrp_api.download([source[len(API_PREFIX):] for source in sources if is_api(source)])
+
+def export_bytes(source):
+    if is_api(source):
+        import hotcrp_api
+        return hotcrp_api.download([source[len(API_PREFIX):]])[0]
+    with open(source, 'rb') as f:
+        return f.read()
+
+def open_export(source):
+    # a file, or an export held in memory after fetching it from HotCRP
+    if is_api(source):
+        return io.StringIO(export_bytes(source).decode('utf8'), newline='')
+    return open(source, 'r', encoding='utf8', newline='')
+
+def resolve_columns(header, columns):
+    # map the requested column names to positions in the header
+    positions = []
+    for column in columns:
+        for name in (column,) + ALIASES.get(column, ()):
+            if name in header:
+                positions.append(header.index(name))
+                break
+        else:
+            raise ValueError('HotCRP export has no column {} (header: {})'.format(column, ','.join(header)))
+    return positions
+
+def read_export(filename, columns, ints=()):
+    '''Stream the rows of a HotCRP export as tuples of the given columns, in file order.'''
+    with open_export(filename) as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        positions = resolve_columns(header, columns)
+        numeric = [column in ints for column in columns]
+        interned = {}
+        # filter drops empty lines
+        for row in filter(None, reader):
+            # concatenated exports repeat the header
+            if row == header:
+                continue
+            values = []
+            for position, is_int in zip(positions, numeric):
+                value = row[position]
+                if is_int:
+                    values.append(int(value) if value != '' else 0)
+                else:
+                    values.append(interned.setdefault(value, value))
+            yield tuple(values)
+
+def read_columns(filename, columns, ints=()):
+    '''Columnar fast path: load the given columns of a HotCRP export into NumPy arrays.
+    Returns a map column -> int32 array for the ints columns, and column -> (int32 codes, values)
+    for the others, where values lists the distinct strings in order of first appearance.'''
+    import numpy as np
+    codes = [{} for column in columns]
+    parts = [array('i') for column in columns]
+    with open_export(filename) as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        get = itemgetter(*resolve_columns(header, columns))
+        repeated = tuple(get(header)) if len(columns) > 1 else (get(header),)
+        rows = map(get, filter(None, reader)) if len(columns) > 1 else ((value,) for value in map(get, filter(None, reader)))
+        # small chunks are transposed with zip and converted a column at a time
+        for chunk in iter(lambda: list(itertools.islice(rows, CHUNK_ROWS)), []):
+            if repeated in chunk:
+                chunk = [values for values in chunk if values != repeated]
+            for column, ids, part, values in zip(columns, codes, parts, zip(*chunk)):
+                # exports repeat few distinct values per column, convert each of them once
+                if column in ints:
+                    numbers = {value: int(value) if value != '' else 0 for value in dict.fromkeys(values)}
+                    part.extend(map(numbers.__getitem__, values))
+                else:
+                    for value in dict.fromkeys(values):
+                        ids.setdefault(value, len(ids))
+                    part.extend(map(ids.__getitem__, values))
+    result = {}
+    for column, ids, part in zip(columns, codes, parts):
+        # the arrays are handed over without a copy
+        values = np.frombuffer(part, dtype=np.int32) if len(part) > 0 else np.zeros(0, dtype=np.int32)
+        result[column] = values if column in ints else (values, list(ids))
+    return result
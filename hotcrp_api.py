@@ -0,0 +1,328 @@
+#!/usr/bin/python3
+'''
+Fetch the HotCRP exports straight from the site instead of downloading them by hand. Scripts take
+hotcrp:users, hotcrp:authors, hotcrp:scores, or hotcrp:allprefs in place of the CSV file names and
+the loaders in hotcrp.py read the fetched export from memory, no intermediate files are written.
+- HOTCRP_SITE: the base URL of the site, e.g. https://sec25.hotcrp.com/
+- HOTCRP_TOKEN: an API token of a chair account (Account settings > Developer), sent as bearer token
+- HOTCRP_EXPORTS (optional): a JSON file mapping export name -> path, if the site's download links
+  differ from EXPORTS below; {papers} in a path is replaced by a range of paper ids
+The client runs on asyncio with a pool of keep-alive connections. Paper exports are split into
+ranges of paper ids that are fetched concurrently, failed requests are retried with exponential
+backoff, and each response is cached with its ETag under .hotcrp-cache/ so that unchanged pages are
+answered with 304 Not Modified instead of being sent again.
+Run `python3 hotcrp_api.py --mock data-dir` for a local mock HotCRP site that serves the exports in
+data-dir (e.g. from synthetic_data.py) with the same paths, ETags, and optional injected failures.
+'''
+import asyncio
+import csv
+import gzip
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import os
+import pickle
+import random
+import re
+import ssl
+import sys
+import time
+from urllib.parse import quote, urlsplit
+
+import instrument
+
+# download links of the HotCRP search and users pages
+EXPORTS = {
+    'users': 'users?t=pc&fn=get&getfn=nameemail',
+    'authors': 'search?q={papers}&t=s&fn=get&getfn=authors',
+    'scores': 'search?q={papers}&t=s&fn=get&getfn=scores',
+    'allprefs': 'search?q={papers}&t=s&fn=get&getfn=allprefs',
+}
+CONNECTIONS = 8          # concurrent requests and pooled connections
+PAGE_PAPERS = 250        # paper ids per request of a paper export
+RETRIES = 5
+BACKOFF = 0.5            # seconds before the first retry, doubled for each further one
+RETRY_STATUS = (429, 500, 502, 503, 504)
+CACHE_DIR = '.hotcrp-cache'
+
+class HotcrpError(Exception):
+    pass
+
+async def read_response(reader):
+    # (status, headers, body) of one HTTP/1.1 response
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError('connection closed by the server')
+    status = int(line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        parts = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                # skip the trailers
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            parts.append(await reader.readexactly(size))
+            await reader.readline()
+        body = b''.join(parts)
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    elif status in (204, 304):
+        body = b''
+    else:
+        # the body ends with the connection
+        body = await reader.read()
+        headers['connection'] = 'close'
+    if headers.get('content-encoding', '').lower() == 'gzip':
+        body = gzip.decompress(body)
+    return status, headers, body
+
+class Client():
+    def __init__(self, site, token=None, connections=CONNECTIONS, cache_dir=CACHE_DIR):
+        url = urlsplit(site)
+        self.host = url.hostname
+        self.port = url.port or (443 if url.scheme == 'https' else 80)
+        self.ssl = ssl.create_default_context() if url.scheme == 'https' else None
+        self.base = url.path.rstrip('/') + '/'
+        self.token = token
+        self.cache_dir = cache_dir
+        self.slots = asyncio.Semaphore(connections)
+        self.idle = []           # open (reader, writer) connections
+        self.requests = 0
+        self.unchanged = 0       # requests answered by the ETag cache
+        self.retries = 0
+
+    def cache_file(self, path):
+        return os.path.join(self.cache_dir, hashlib.sha1('{}:{}{}{}'.format(self.host, self.port, self.base, path).encode()).hexdigest())
+
+    async def request(self, path, headers):
+        async with self.slots:
+            if len(self.idle) > 0:
+                reader, writer = self.idle.pop()
+            else:
+                reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+            lines = ['GET {}{} HTTP/1.1'.format(self.base, path), 'Host: {}'.format(self.host), 'Accept-Encoding: gzip']
+            lines.extend('{}: {}'.format(name, value) for name, value in headers.items())
+            try:
+                writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+                await writer.drain()
+                status, response_headers, body = await read_response(reader)
+            except BaseException:
+                writer.close()
+                raise
+            if response_headers.get('connection', '').lower() == 'close':
+                writer.close()
+            else:
+                self.idle.append((reader, writer))
+            return status, response_headers, body
+
+    async def get(self, path):
+        '''Body of a GET request, from the ETag cache if the server reports no change.'''
+        cached = None
+        cache_file = self.cache_file(path) if self.cache_dir != None else None
+        if cache_file != None and os.path.exists(cache_file):
+            with open(cache_file, 'rb') as f:
+                cached = pickle.load(f) # (etag, body)
+        headers = {}
+        if self.token != None:
+            headers['Authorization'] = 'Bearer {}'.format(self.token)
+        if cached != None:
+            headers['If-None-Match'] = cached[0]
+        for attempt in range(RETRIES + 1):
+            delay = BACKOFF * 2**attempt
+            try:
+                self.requests += 1
+                status, response_headers, body = await self.request(path, headers)
+            except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+                # also a pooled connection that the server closed in the meantime
+                error = '{}: {}'.format(type(e).__name__, e)
+            else:
+                if status == 304 and cached != None:
+                    self.unchanged += 1
+                    return cached[1]
+                if status == 200:
+                    if cache_file != None and 'etag' in response_headers:
+                        # the exports are confidential, only the owner may read the cache
+                        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+                        with open(cache_file+'.tmp', 'wb') as f:
+                            pickle.dump((response_headers['etag'], body), f, protocol=pickle.HIGHEST_PROTOCOL)
+                        os.replace(cache_file+'.tmp', cache_file)
+                    return body
+                if status not in RETRY_STATUS:
+                    raise HotcrpError('HotCRP answered {} for {}{}'.format(status, self.base, path))
+                error = 'HTTP {}'.format(status)
+                if response_headers.get('retry-after', '').isdigit():
+                    delay = int(response_headers['retry-after'])
+            if attempt < RETRIES:
+                self.retries += 1
+                # jitter keeps concurrent retries from hitting the server at the same time
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+        raise HotcrpError('Giving up on {}{} after {} attempts: {}'.format(self.base, path, RETRIES + 1, error))
+
+    def close(self):
+        for reader, writer in self.idle:
+            writer.close()
+        self.idle = []
+
+def is_empty(page):
+    # only the header line, or nothing at all
+    return page.strip().count(b'\n') == 0
+
+async def fetch_export(client, path, connections):
+    if '{papers}' not in path:
+        return await client.get(path)
+    # windows of concurrent paper ranges, until a whole window has no papers: paper ids have gaps
+    # where papers were withdrawn or deleted, an empty range alone does not mean the end
+    pages = []
+    first = 1
+    while True:
+        ranges = ['{}-{}'.format(low, low + PAGE_PAPERS - 1) for low in range(first, first + connections*PAGE_PAPERS, PAGE_PAPERS)]
+        window = await asyncio.gather(*(client.get(path.format(papers=quote(papers))) for papers in ranges))
+        pages.extend(window)
+        if all(is_empty(page) for page in window):
+            break
+        first += connections*PAGE_PAPERS
+    # each page repeats the header, which the loaders skip
+    pages = [page if page.endswith(b'\n') else page + b'\n' for page in pages if not is_empty(page)] or pages[:1]
+    return b''.join(pages)
+
+def export_paths():
+    paths = dict(EXPORTS)
+    if os.environ.get('HOTCRP_EXPORTS'):
+        with open(os.environ['HOTCRP_EXPORTS']) as f:
+            paths.update(json.load(f))
+    return paths
+
+async def fetch_all(site, token, names, connections=CONNECTIONS, cache_dir=CACHE_DIR):
+    '''Fetch the named exports concurrently over one connection pool, returns their bodies.'''
+    paths = export_paths()
+    for name in names:
+        if name not in paths:
+            raise HotcrpError('Unknown HotCRP export {}, expected one of {}'.format(name, ', '.join(sorted(paths))))
+    client = Client(site, token, connections, cache_dir)
+    start = time.perf_counter()
+    try:
+        bodies = await asyncio.gather(*(fetch_export(client, paths[name], connections) for name in names))
+    finally:
+        client.close()
+    print('[hotcrp_api] fetched {} in {:.2f}s: {} requests, {} unchanged, {} retries'.format(
+        ', '.join(names), time.perf_counter() - start, client.requests, client.unchanged, client.retries), file=sys.stderr, flush=True)
+    return bodies
+
+FETCHED = {} # export name -> body, every export is fetched once per process
+
+def download(names):
+    '''Bodies of the named exports of the site in HOTCRP_SITE, fetching the ones not fetched yet.'''
+    missing = [name for name in dict.fromkeys(names) if name not in FETCHED]
+    if len(missing) > 0:
+        if not os.environ.get('HOTCRP_SITE'):
+            raise HotcrpError('Set HOTCRP_SITE (and HOTCRP_TOKEN) to read hotcrp:{} from HotCRP'.format(missing[0]))
+        bodies = asyncio.run(fetch_all(os.environ['HOTCRP_SITE'], os.environ.get('HOTCRP_TOKEN'), missing))
+        FETCHED.update(zip(missing, bodies))
+    return [FETCHED[name] for name in names]
+
+# local mock of a HotCRP site
+
+def path_pattern(path):
+    # the request path of an export, with the paper range as groups
+    return re.compile('^/' + re.escape(path).replace(re.escape('{papers}'), r'(\d+)-(\d+)') + '$')
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive, as a real server
+
+    def do_GET(self):
+        mock = self.server.mock
+        if mock.token != None and self.headers.get('Authorization') != 'Bearer {}'.format(mock.token):
+            self.reply(401, b'')
+            return
+        if random.random() < mock.faults:
+            self.reply(503, b'', {'Retry-After': '0'})
+            return
+        for name, pattern in mock.patterns.items():
+            found = pattern.match(self.path)
+            if found != None:
+                break
+        else:
+            self.reply(404, b'')
+            return
+        body = mock.page(name, found.groups())
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            self.reply(304, b'', {'ETag': etag})
+            return
+        headers = {'ETag': etag, 'Content-Type': 'text/csv; charset=utf-8'}
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            headers['Content-Encoding'] = 'gzip'
+        self.reply(200, body, headers)
+
+    def reply(self, status, body, headers={}):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.mock.verbose:
+            print('{} {}'.format(self.address_string(), format % args), file=sys.stderr, flush=True)
+
+class MockSite():
+    '''Serves data_dir/hotcrp-<name>.csv at the export paths, paper exports by range of paper ids.'''
+    def __init__(self, data_dir, token=None, faults=0.0, verbose=False):
+        self.data_dir = data_dir
+        self.token = token
+        self.faults = faults # share of requests failing with 503
+        self.verbose = verbose
+        self.patterns = {name: path_pattern(path) for name, path in export_paths().items()}
+        self.rows = {} # export name -> (modification time, rows)
+
+    def page(self, name, papers):
+        # reread when the file changes, so that the answers change as on a live site
+        filename = os.path.join(self.data_dir, 'hotcrp-{}.csv'.format(name))
+        if name not in self.rows or self.rows[name][0] != os.stat(filename).st_mtime_ns:
+            with open(filename, 'r', encoding='utf8', newline='') as f:
+                self.rows[name] = (os.stat(filename).st_mtime_ns, list(csv.reader(f)))
+        rows = self.rows[name][1]
+        if len(papers) == 2 and len(rows) > 0:
+            low, high = int(papers[0]), int(papers[1])
+            column = rows[0].index('paper')
+            rows = rows[:1] + [row for row in rows[1:] if row and row[column].isdigit() and low <= int(row[column]) <= high]
+        out = io.StringIO(newline='')
+        csv.writer(out).writerows(rows)
+        return out.getvalue().encode('utf8')
+
+class MockServer(ThreadingHTTPServer):
+    request_queue_size = 64 # the client opens its pooled connections at once
+
+def serve_mock(site, port):
+    server = MockServer(('127.0.0.1', port), MockHandler)
+    server.mock = site
+    print('Mock HotCRP serving {} on http://127.0.0.1:{}/'.format(site.data_dir, server.server_port), file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == '__main__':
+    port = instrument.parse_number(instrument.pop_option(sys.argv, '--port', 8643), int, 0)
+    faults = instrument.parse_number(instrument.pop_option(sys.argv, '--faults', 0.0), float, 0)
+    verbose = '-v' in sys.argv
+    if verbose:
+        sys.argv.remove('-v')
+    if len(sys.argv) != 3 or sys.argv[1] != '--mock' or port == None or faults == None or faults > 1:
+        print('Serve HotCRP exports as a local mock site. Run the script with: python3 {} [--port 8643] [--faults share] [-v] --mock data-dir'.format(sys.argv[0]))
+        exit(1)
+    serve_mock(MockSite(sys.argv[2], os.environ.get('HOTCRP_TOKEN'), faults, verbose), port)
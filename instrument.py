@@ -0,0 +1,139 @@
+#!/usr/bin/python3
+'''
+Instrumentation shared by the scripts, everything is written to stderr so that the regular
+output is unchanged:
+- Progress: a periodic progress line for the long DBLP passes with records/s, bytes read and
+  decompressed, the share of the dump done, the year of the current record, what was found so
+  far, and the resident memory
+- Timers: wall and CPU time (own and of worker processes) plus peak RSS for each stage
+- --profile FILE on the command line: FILE.json gets the stage timings as JSON, any other name
+  gets a cProfile dump per stage as FILE-<stage>.prof (worker processes are not profiled)
+'''
+import contextlib
+import cProfile
+from datetime import datetime
+import json
+import os
+import resource
+import sys
+import time
+
+PROGRESS_INTERVAL = 10 # seconds between progress lines
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    rss = resource.getrusage(who).ru_maxrss
+    return rss / (1024*1024) if sys.platform == 'darwin' else rss / 1024
+
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024*1024)
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+class Progress():
+    def __init__(self, label, dblp_file=None, found='found', interval=PROGRESS_INTERVAL):
+        self.label = label
+        self.total = os.path.getsize(dblp_file) if dblp_file != None and os.path.isfile(dblp_file) else 0
+        self.found_label = found
+        self.interval = interval
+        self.records = 0
+        self.found = 0       # what the caller is looking for, e.g. matches
+        self.year = None     # year of the last record
+        self.bytes_in = 0    # compressed bytes read
+        self.bytes_out = 0   # decompressed bytes
+        self.measure = None  # optional callable returning (bytes_in, bytes_out)
+        self.start = time.perf_counter()
+        self.last = self.start
+
+    def tick(self, records=1, year=None):
+        self.records += records
+        if year:
+            self.year = year
+        now = time.perf_counter()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.report()
+
+    def report(self):
+        if self.measure != None:
+            self.bytes_in, self.bytes_out = self.measure()
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        line = '[{}] {:.0f}s: {} records ({:.0f}/s), {:.0f} MB decompressed'.format(self.label, elapsed, self.records, self.records/elapsed, self.bytes_out/(1024*1024))
+        if self.total > 0 and self.bytes_in > 0:
+            done = self.bytes_in/self.total
+            line += ', {:.1f}% of the dump (about {:.0f}s left)'.format(done*100, elapsed*(1-done)/done)
+        if self.year != None:
+            line += ', year {}'.format(self.year)
+        line += ', {} {}, {:.0f} MB RSS'.format(self.found, self.found_label, current_rss_mb())
+        print(line, file=sys.stderr, flush=True)
+
+class Timers():
+    def __init__(self, label, profile=None):
+        self.label = label
+        self.profile = profile
+        self.stages = []
+        self.started = datetime.now()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        profiler = None
+        if self.profile != None and not self.profile.endswith('.json'):
+            profiler = cProfile.Profile()
+        start = time.perf_counter()
+        cpu = time.process_time()
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        if profiler != None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler != None:
+                profiler.disable()
+                profiler.dump_stats('{}-{}.prof'.format(os.path.splitext(self.profile)[0], name.replace(' ', '_')))
+            after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            timing = {'stage': name, 'wall': time.perf_counter() - start, 'cpu': time.process_time() - cpu,
+                      'workers_cpu': max(0.0, after.ru_utime + after.ru_stime - children.ru_utime - children.ru_stime),
+                      'peak_rss_mb': peak_rss_mb(), 'workers_peak_rss_mb': peak_rss_mb(resource.RUSAGE_CHILDREN)}
+            self.stages.append(timing)
+            print('[{}] {}: {:.2f}s wall, {:.2f}s CPU, {:.2f}s worker CPU, peak RSS {:.0f} MB'.format(
+                self.label, name, timing['wall'], timing['cpu'], timing['workers_cpu'], timing['peak_rss_mb']), file=sys.stderr, flush=True)
+
+    def finish(self):
+        if self.profile == None or not self.profile.endswith('.json'):
+            return
+        with open(self.profile, 'w') as f:
+            json.dump({'script': self.label, 'argv': sys.argv[1:], 'started': self.started.isoformat(timespec='seconds'),
+                       'stages': self.stages}, f, indent=1)
+
+def pop_option(argv, name, default, values=1):
+    # strip an optional "name value" (or a name with several values) from the command line, None if
+    # the command line ends before all values
+    if name not in argv:
+        return default
+    i = argv.index(name)
+    found = argv[i+1:i+1+values]
+    del argv[i:i+1+values]
+    if len(found) < values:
+        return None
+    return found[0] if values == 1 else found
+
+def parse_number(value, kind=int, minimum=1):
+    # the value of a numeric option, None if it is missing, not a number, or below minimum; the
+    # scripts print their usage for None
+    try:
+        number = kind(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number >= minimum else None
+
+def pop_workers(argv):
+    # strip an optional "-j N" from the command line, default to a single process; returns 0 if N
+    # is missing or not a positive number, for which the scripts print their usage
+    return parse_number(pop_option(argv, '-j', 1)) or 0
+
+def pop_profile(argv):
+    # strip an optional "--profile FILE" from the command line and return the timers of the script
+    profile = pop_option(argv, '--profile', None)
+    return Timers(os.path.splitext(os.path.basename(argv[0]))[0], profile)
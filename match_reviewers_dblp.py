@@ -3,12 +3,27 @@
 The goal of this script is to match the reviewer names and emails to the names used in DBLP.
 Input: select reviewers from the user list in HotCRP and download the reviewer file.
 '''
-import lxml.etree as ET
-from gzip import GzipFile
 import pickle
 import csv
+from difflib import SequenceMatcher
+import os
 import re
 import sys
+import unicodedata
+
+import dblp
+import instrument
+from dblp_index import DblpIndex
+from hotcrp import export_name, read_export
+
+HOMONYM_RE = re.compile(r' \d{4}$')
+TOKEN_RE = re.compile(r'[^\W\d_]+') # runs of letters, hyphens and dots separate name parts
+# letters that have no decomposition into a base letter and an accent
+TRANSLITERATIONS = str.maketrans({'ß': 'ss', 'ø': 'o', 'Ø': 'O', 'æ': 'ae', 'Æ': 'AE', 'œ': 'oe', 'Œ': 'OE',
+                                  'ł': 'l', 'Ł': 'L', 'đ': 'd', 'Đ': 'D', 'ð': 'd', 'þ': 'th', 'ı': 'i', '’': ''})
+FUZZY_THRESHOLD = 0.85 # minimum similarity of a fuzzy match
+FUZZY_CANDIDATES = 5   # fuzzy matches kept per reviewer
+FUZZY_CACHE = 1 << 18  # DBLP names remembered by the fuzzy matcher, prolific authors recur
 
 class Author():
     def __init__(self, name, email, orcid, dblp):
@@ -16,69 +31,240 @@ class Author():
         self.email = email
         self.orcid = orcid
         self.dblp = dblp
+        self.orcid_dblp = [] # DBLP names carrying the reviewer's ORCID
+        self.fuzzy = {}      # DBLP name -> similarity of fuzzy matches
+        self.candidates = [] # the most similar fuzzy matches, never used without a manual check
 
 def get_reviewers(hotcrp_users):
     reviewers = []
-    with open(hotcrp_users, 'r') as f:
-        hotcrp_users_csv = csv.reader(f)
-        for row in hotcrp_users_csv:
-            if row[0] == 'given_name':
-                continue
-            aut = Author(row[0]+' '+row[1], row[2], row[5], [])
-            #reviewers[row[0]+' '+row[1]] = aut
-            reviewers.append(aut)
+    for given_name, family_name, email, orcid in read_export(hotcrp_users, ('given_name', 'family_name', 'email', 'orcid')):
+        aut = Author(given_name+' '+family_name, email, orcid, [])
+        #reviewers[given_name+' '+family_name] = aut
+        reviewers.append(aut)
     return reviewers
 
-def parse_dblp(dblp_file, reviewers):
-    dblp_stream = GzipFile(filename=dblp_file)
-    authors = []
-    in_pub = False # flag marking if we're parsing a publication
-    in_www = False # flag marking if we're parsing affiliation information
-
-    for event, elem in ET.iterparse(dblp_stream, events = ('start', 'end',), load_dtd = True):
-        # mark header tags
-        if event == 'start':
-            if elem.tag == 'inproceedings' or elem.tag == 'article':
-                in_pub = True
-            if elem.tag == 'www':
-                in_www = True
-        # process individual closing tags
-        if event == 'end':
-            if (in_pub or in_www) and elem.tag == 'author':
-                authors.append(elem.text)
-            elif elem.tag == 'inproceedings' or elem.tag == 'article':
-                for author in authors:
-                    for hc_author in reviewers:
-                        if author != None and author.startswith(hc_author.name) and (len(author) == len(hc_author.name) or author[len(hc_author.name)] == ' '):
-                            if not author in hc_author.dblp:
-                                hc_author.dblp.append(author)
-                                print('Found a match: HC {} -> {}'.format(hc_author.name, author))
-                authors = []
-                in_pub = False
-            elif elem.tag == 'www':
-                authors = []
-                in_www = False
-            elem.clear()
+def base_name(author):
+    # DBLP disambiguates homonyms with a numeric suffix, e.g. "Jane Doe 0002"
+    return HOMONYM_RE.sub('', author)
+
+def name_tokens(name):
+    # "Jean-Luc  Müller 0002" -> ['jean', 'luc', 'muller'], the homonym suffix is no letter
+    if not name.isascii():
+        name = unicodedata.normalize('NFKD', name.translate(TRANSLITERATIONS))
+        name = ''.join(c for c in name if not unicodedata.combining(c))
+    return TOKEN_RE.findall(name.casefold().replace("'", ''))
+
+def spellings(token):
+    # Mueller and Muller are the same name, list both spellings: with and without an e after a, o, u
+    variants = ['']
+    for c in token.replace('ae', 'a').replace('oe', 'o').replace('ue', 'u'):
+        variants = [variant + c for variant in variants] + ([variant + c + 'e' for variant in variants] if c in 'aou' else [])
+    return variants
+
+def block_keys(tokens):
+    # (initial, name part): the first initial with every later name part, and the last initial with
+    # the first name part for names written family name first
+    if len(tokens) < 2:
+        return []
+    keys = [(tokens[0][0], token) for token in tokens[1:] if len(token) > 1]
+    if len(tokens[0]) > 1:
+        keys.append((tokens[-1][0], tokens[0]))
+    return keys
+
+def given_similarity(a, b):
+    # an initial matches any given name with that letter, a bit below the full name
+    if len(a) == 1 or len(b) == 1:
+        return 0.9 if a[0] == b[0] else 0.0
+    return SequenceMatcher(None, a, b).ratio()
+
+def name_similarity(a, b):
+    '''Similarity of two tokenized names in [0, 1]: given names and family names are compared
+    separately, middle names are ignored, and the family name may be any later part of b.'''
+    if a == b:
+        return 1.0
+    best = 0.0
+    for tokens in (a, a[::-1]):
+        family = max(SequenceMatcher(None, tokens[-1], token).ratio() for token in b[1:])
+        best = max(best, (given_similarity(tokens[0], b[0]) + family) / 2)
+    return best
+
+class FuzzyIndex():
+    # blocking index of the reviewers, only names sharing a block key with a reviewer are scored
+    def __init__(self, reviewers):
+        self.names = [hc_author.name for hc_author in reviewers]
+        self.tokens = [name_tokens(hc_author.name) for hc_author in reviewers]
+        self.blocks = {} # spelling of a name part -> (initial, reviewer position)
+        for i, tokens in enumerate(self.tokens):
+            for initial, part in block_keys(tokens):
+                for spelling in spellings(part):
+                    self.blocks.setdefault(spelling, []).append((initial, i))
+        self.scored = {} # DBLP name -> matches, cleared when full to bound memory
+
+    def match(self, author):
+        '''Returns (reviewer position, similarity) of the reviewers similar to a DBLP name, but not
+        matching it exactly.'''
+        if author in self.scored:
+            return self.scored[author]
+        if len(self.scored) >= FUZZY_CACHE:
+            self.scored.clear()
+        matches = []
+        tokens = name_tokens(author)
+        if len(tokens) >= 2:
+            # the spellings are in the blocks already, so the name parts are looked up as they are
+            first = tokens[0][0]
+            candidates = [i for token in tokens[1:] for initial, i in self.blocks.get(token, ()) if initial == first]
+            candidates.extend(i for initial, i in self.blocks.get(tokens[0], ()) if initial == tokens[-1][0])
+            for i in sorted(set(candidates)):
+                if self.names[i] == base_name(author):
+                    continue
+                similarity = name_similarity(self.tokens[i], tokens)
+                if similarity >= FUZZY_THRESHOLD:
+                    matches.append((i, similarity))
+        self.scored[author] = matches
+        return matches
+
+def build_name_index(reviewers):
+    # map HotCRP name -> positions of reviewers with that name, so each DBLP author costs a single lookup
+    name_index = {}
+    for i, hc_author in enumerate(reviewers):
+        name_index.setdefault(hc_author.name, []).append(i)
+    return name_index
+
+def build_orcid_index(reviewers):
+    orcid_index = {}
+    for i, hc_author in enumerate(reviewers):
+        orcid = dblp.normalize_orcid(hc_author.orcid)
+        if orcid != '':
+            orcid_index.setdefault(orcid, []).append(i)
+    return orcid_index
+
+def match_records(records, context):
+    # returns (reviewer position, DBLP name, ORCID or None, similarity or None) for each match, in DBLP order,
+    # and the names of the persons with aliases
+    name_index, orcid_index, fuzzy = context
+    matches = []
+    persons = []
+    for record in records:
+        if len(dblp.person_names(record)) > 0:
+            persons.append(dblp.person_names(record))
+        for author in record.orcids:
+            for i in orcid_index.get(record.orcids[author], ()):
+                matches.append((i, author, record.orcids[author], None))
+        if record.tag in dblp.PUB_TAGS:
+            for author in record.authors:
+                for i in name_index.get(base_name(author), ()):
+                    matches.append((i, author, None, None))
+            if fuzzy != None:
+                for author in record.authors:
+                    for i, similarity in fuzzy.match(author):
+                        matches.append((i, author, None, similarity))
+    return matches, persons
+
+def add_matches(reviewers, matches):
+    # returns the number of new matches
+    added = 0
+    for i, author, orcid, similarity in matches:
+        hc_author = reviewers[i]
+        if orcid != None:
+            if not author in hc_author.orcid_dblp:
+                hc_author.orcid_dblp.append(author)
+                added += 1
+                print('Found an ORCID match: HC {} ({}) -> {}'.format(hc_author.name, orcid, author))
+        elif similarity != None:
+            if not author in hc_author.fuzzy:
+                hc_author.fuzzy[author] = similarity
+                added += 1
+                print('Found a fuzzy match: HC {} -> {} ({:.2f})'.format(hc_author.name, author, similarity))
+        elif not author in hc_author.dblp:
+            hc_author.dblp.append(author)
+            added += 1
+            print('Found a match: HC {} -> {}'.format(hc_author.name, author))
+    return added
+
+def order_matches(reviewers):
+    # ORCID matches are exact, list them first so they are picked up by find_coauthors.py
+    # fuzzy matches are only candidates, the most similar first
+    for hc_author in reviewers:
+        hc_author.dblp = hc_author.orcid_dblp + [author for author in hc_author.dblp if author not in hc_author.orcid_dblp]
+        fuzzy = sorted((author for author in hc_author.fuzzy if author not in hc_author.dblp), key=lambda author: -hc_author.fuzzy[author])
+        hc_author.candidates = fuzzy[:FUZZY_CANDIDATES]
+
+def add_aliases(reviewers, aliases):
+    # list the other names DBLP knows for a matched person right after the match, so that
+    # find_coauthors.py also finds the publications under a former name or another spelling
+    for hc_author in reviewers:
+        names = []
+        for author in hc_author.dblp:
+            for name in [author] + aliases.names_of(author):
+                if name not in names and (name == author or name not in hc_author.dblp):
+                    names.append(name)
+                    if name != author:
+                        print('Found an alias: HC {} -> {} (also {})'.format(hc_author.name, name, author))
+        hc_author.dblp = names
+
+def parse_dblp(dblp_file, reviewers, workers=1, progress=None, fuzzy=False):
+    context = (build_name_index(reviewers), build_orcid_index(reviewers), FuzzyIndex(reviewers) if fuzzy else None)
+    if workers > 1:
+        partials = dblp.map_records(dblp_file, match_records, context, workers, progress=progress)
+    else:
+        partials = (match_records([record], context) for record in dblp.iter_records(dblp_file, progress=progress))
+    aliases = dblp.Aliases()
+    for matches, persons in partials:
+        added = add_matches(reviewers, matches)
+        if progress != None:
+            progress.found += added
+        for names in persons:
+            aliases.add(names)
+    order_matches(reviewers)
+    add_aliases(reviewers, aliases)
+
+def parse_index(index, reviewers, fuzzy=False):
+    name_index = build_name_index(reviewers)
+    orcid_index = build_orcid_index(reviewers)
+    fuzzy_index = FuzzyIndex(reviewers) if fuzzy else None
+    for orcid in orcid_index:
+        for aid in index.orcids.get(orcid, ()):
+            add_matches(reviewers, [(i, index.names[aid], orcid, None) for i in orcid_index[orcid]])
+    # names are interned in order of first appearance, so matches come out in the same order as parse_dblp
+    for aid, author in enumerate(index.names):
+        if index.has_pubs(aid):
+            add_matches(reviewers, [(i, author, None, None) for i in name_index.get(base_name(author), ())])
+            if fuzzy_index != None:
+                add_matches(reviewers, [(i, author, None, similarity) for i, similarity in fuzzy_index.match(author)])
+    order_matches(reviewers)
+    add_aliases(reviewers, index.aliases())
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2 and len(sys.argv) != 3:
-        print('Map HotCRP reviewers to DBLP names. Run the script with: python3 {} hotcrp-users.csv [dblp.xml.gz]'.format(sys.argv[0]))
+    workers = instrument.pop_workers(sys.argv)
+    # also rank similar names: diacritics, initials, hyphens, and reordered names
+    fuzzy = '--fuzzy' in sys.argv
+    if fuzzy:
+        sys.argv.remove('--fuzzy')
+    timers = instrument.pop_profile(sys.argv)
+    if (len(sys.argv) != 2 and len(sys.argv) != 3) or workers < 1:
+        print('Map HotCRP reviewers to DBLP names. Run the script with: python3 {} [-j workers] [--fuzzy] [--profile timings.json|stats.prof] hotcrp-users.csv [dblp.xml.gz|dblp-index]'.format(sys.argv[0]))
         exit(1)
     # Parse reviewers from HotCRP CSV
-    reviewers = get_reviewers(sys.argv[1])
+    with timers.stage('read reviewers'):
+        reviewers = get_reviewers(sys.argv[1])
 
     if len(sys.argv) == 2:
         dblp_file = './dblp.xml.gz'
     else:
         dblp_file = sys.argv[2]
-    parse_dblp(dblp_file, reviewers)
+    if os.path.isdir(dblp_file):
+        with timers.stage('match index'):
+            parse_index(DblpIndex(dblp_file), reviewers, fuzzy)
+    else:
+        with timers.stage('match dblp'):
+            parse_dblp(dblp_file, reviewers, workers, instrument.Progress('match_reviewers_dblp', dblp_file, 'matches'), fuzzy)
 
     for reviewer in reviewers:
         print('{} -> {}'.format(reviewer.name, len(reviewer.dblp)))
 
 
-    with open(sys.argv[1][:-4]+'-mapped.csv', 'w') as f:
+    with open(export_name(sys.argv[1])[:-4]+'-mapped.csv', 'w') as f:
         mapped_csv = csv.writer(f)
         # rows in CSV: name in hotcrap, email, orcid, dblp_match1, dblp_match2, ...
         for reviewer in reviewers:
@@ -86,4 +272,14 @@ if __name__ == '__main__':
             row.extend(reviewer.dblp)
             mapped_csv.writerow(row)
         f.close()
+    if fuzzy:
+        # a guess must not become a reviewer's identity, the candidates go to their own file and
+        # the right one is copied into the mapped CSV by hand
+        with open(export_name(sys.argv[1])[:-4]+'-fuzzy.csv', 'w') as f:
+            fuzzy_csv = csv.writer(f)
+            fuzzy_csv.writerow(['name', 'email', 'orcid', 'dblp', 'similarity'])
+            for reviewer in reviewers:
+                for author in reviewer.candidates:
+                    fuzzy_csv.writerow([reviewer.name, reviewer.email, reviewer.orcid, author, '{:.2f}'.format(reviewer.fuzzy[author])])
+    timers.finish()
 
@@ -0,0 +1,254 @@
+#!/usr/bin/python3
+'''
+The goal of this script is to run all steps of the README in one go and to only rerun what is out
+of date. The steps form a graph through their files: match_reviewers_dblp.py writes the mapped
+reviewers that find_coauthors.py reads, whose coauthor store the conflict checks read, and so on.
+Each step is keyed by a hash of its script and the repo modules it imports, its parameters, and
+the contents of its input files.
+A step whose key and outputs did not change since its last run is skipped, all others run as soon
+as their inputs are ready, independent steps side by side.
+All files live in one work directory under the names the README uses; each step logs to
+<step>.log there and the state of the last runs is kept in .pipeline-state.json.
+
+The mapped reviewers need a manual check. When match_reviewers_dblp.py (re)writes them the steps
+that depend on them wait for the next run, and hand edits of the file are kept.
+'''
+import ast
+import concurrent.futures
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+import instrument
+
+STATE_VERSION = 1
+STATE_FILE = '.pipeline-state.json'
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# caches that later steps write into the DBLP index, dblp_index.py removes them when it rebuilds
+# the index and they are not part of its digest
+DERIVED_PREFIXES = ('adjacency-',)
+
+class Step():
+    def __init__(self, name, script, args, inputs, outputs, params=[], options=[], review=False, caches=[]):
+        self.name = name
+        self.script = script
+        self.args = args       # file arguments, relative to the work directory
+        self.inputs = inputs   # files and directories the output depends on
+        self.outputs = outputs
+        self.params = params   # options that change the output, part of the key
+        self.options = options # options that do not, e.g. the number of workers
+        self.review = review   # the output is checked and edited by hand
+        self.caches = caches   # shared caches the step writes, steps that share one never run side by side
+
+def build_steps(work_dir, workers, index, fuzzy, hops):
+    dblp = 'dblp-index' if index else 'dblp.xml.gz'
+    jobs = ['-j', str(workers)] if workers > 1 and not index else []
+    steps = []
+    if index:
+        steps.append(Step('dblp_index', 'dblp_index.py', ['dblp.xml.gz', 'dblp-index'], ['dblp.xml.gz'], ['dblp-index'], options=['-j', str(workers)] if workers > 1 else []))
+    steps.append(Step('match_reviewers', 'match_reviewers_dblp.py', ['hotcrp-users.csv', dblp], ['hotcrp-users.csv', dblp], ['hotcrp-users-mapped.csv'] + (['hotcrp-users-fuzzy.csv'] if fuzzy else []), ['--fuzzy'] if fuzzy else [], jobs, review=True))
+    # without the index only the DBLP records changed since the last snapshot are processed
+    steps.append(Step('find_coauthors', 'find_coauthors.py', ['hotcrp-users-mapped.csv', dblp], ['hotcrp-users-mapped.csv', dblp], ['hotcrp-users-mapped.db'], [], jobs + ([] if index else ['--refresh'])))
+    transitive = ['--hops', str(hops), 'dblp-index'] if hops > 1 else []
+    steps.append(Step('check_reviews', 'check_reviews.py', ['hotcrp-users-mapped.db', 'hotcrp-authors.csv', 'hotcrp-scores.csv', 'conflicts.csv'],
+                      ['hotcrp-users-mapped.db', 'hotcrp-authors.csv', 'hotcrp-scores.csv'] + (['dblp-index'] if hops > 1 else []), ['conflicts.csv'], transitive,
+                      caches=['dblp-index/adjacency'] if hops > 1 else []))
+    steps.append(Step('conflict_matrix', 'conflict_matrix.py', ['hotcrp-users-mapped.db', 'hotcrp-authors.csv', 'conflicts-upload.csv'],
+                      ['hotcrp-users-mapped.db', 'hotcrp-authors.csv'], ['conflicts-upload.csv', 'conflicts-upload-evidence.csv']))
+    identities = ['--authors', 'hotcrp-authors.csv', 'dblp-index'] if index else []
+    steps.append(Step('check_identities', 'check_identities.py', ['hotcrp-users-mapped.db', 'identities.csv'],
+                      ['hotcrp-users-mapped.db'] + (['hotcrp-authors.csv', 'dblp-index'] if index else []), ['identities.csv'], identities,
+                      caches=['dblp-index/adjacency'] if index else []))
+    # the bidding reports are their logs
+    steps.append(Step('check_bidding', 'check_bidding.py', ['hotcrp-authors.csv', 'hotcrp-allprefs.csv'], ['hotcrp-authors.csv', 'hotcrp-allprefs.csv'], ['check_bidding.log']))
+    steps.append(Step('check_rings', 'check_rings.py', ['hotcrp-authors.csv', 'hotcrp-allprefs.csv'], ['hotcrp-authors.csv', 'hotcrp-allprefs.csv'], ['check_rings.log']))
+    if os.path.exists(os.path.join(work_dir, 'manifest.csv')):
+        from compute_bai import read_manifest
+        from hotcrp import is_api
+        cycles = [os.path.relpath(source, work_dir) for entry in read_manifest(os.path.join(work_dir, 'manifest.csv')) for source in entry[3:5] if not is_api(source)]
+        steps.append(Step('compute_bai', 'compute_bai.py', ['manifest.csv', 'bai.csv'], ['manifest.csv'] + cycles, ['bai.csv'], [], ['-j', str(workers)] if workers > 1 else []))
+    return steps
+
+class Pipeline():
+    def __init__(self, work_dir, steps):
+        self.dir = work_dir
+        self.steps = steps
+        self.producers = {output: step for step in steps for output in step.outputs}
+        self.modules = {} # script -> the repo modules it imports
+        self.state_file = os.path.join(work_dir, STATE_FILE)
+        self.state = None
+        if os.path.exists(self.state_file):
+            with open(self.state_file, 'r') as f:
+                self.state = json.load(f)
+        if self.state == None or self.state['version'] != STATE_VERSION:
+            self.state = {'version': STATE_VERSION,
+                          'files': {},  # path -> [mtime, size, digest], files are only hashed again when they change
+                          'steps': {}}  # step -> {'key': digest, 'outputs': {output: digest}}
+
+    def save(self):
+        # written after every step, an interrupted run keeps what finished
+        with open(self.state_file+'.tmp', 'w') as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(self.state_file+'.tmp', self.state_file)
+
+    def file_digest(self, path):
+        info = os.stat(path)
+        cached = self.state['files'].get(path)
+        if cached != None and cached[0] == info.st_mtime_ns and cached[1] == info.st_size:
+            return cached[2]
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024*1024), b''):
+                sha.update(block)
+        self.state['files'][path] = [info.st_mtime_ns, info.st_size, sha.hexdigest()]
+        return sha.hexdigest()
+
+    def digest(self, name):
+        # contents of a file, or of all files of a directory
+        path = os.path.join(self.dir, name)
+        if not os.path.exists(path):
+            return None
+        if not os.path.isdir(path):
+            return self.file_digest(path)
+        sha = hashlib.sha1()
+        for filename in sorted(os.listdir(path)):
+            if not filename.startswith(DERIVED_PREFIXES):
+                sha.update('{}\t{}\n'.format(filename, self.file_digest(os.path.join(path, filename))).encode('utf8'))
+        return sha.hexdigest()
+
+    def imported_modules(self, script):
+        # the script and every repo module it imports, directly or through other modules, including
+        # the imports inside functions: a fix in dblp.py or a new store version changes the outputs
+        if script not in self.modules:
+            found = set()
+            todo = [script]
+            while len(todo) > 0:
+                filename = todo.pop()
+                if filename in found:
+                    continue
+                found.add(filename)
+                with open(os.path.join(SCRIPT_DIR, filename), 'rb') as f:
+                    tree = ast.parse(f.read(), filename)
+                for node in ast.walk(tree):
+                    if isinstance(node, ast.Import):
+                        names = [alias.name for alias in node.names]
+                    elif isinstance(node, ast.ImportFrom) and node.level == 0:
+                        names = [node.module]
+                    else:
+                        continue
+                    todo.extend(name.split('.')[0]+'.py' for name in names if os.path.exists(os.path.join(SCRIPT_DIR, name.split('.')[0]+'.py')))
+            self.modules[script] = sorted(found)
+        return self.modules[script]
+
+    def key(self, step):
+        code = [(module, self.file_digest(os.path.join(SCRIPT_DIR, module))) for module in self.imported_modules(step.script)]
+        return hashlib.sha1(repr((step.name, code, step.params, step.args, [(name, self.digest(name)) for name in step.inputs])).encode('utf8')).hexdigest()
+
+    def is_current(self, step, key):
+        record = self.state['steps'].get(step.name)
+        if step.review and all(self.digest(output) != None for output in step.outputs):
+            if record == None or any(self.digest(output) != record['outputs'].get(output) for output in step.outputs):
+                # edited by hand (or written before the pipeline ran it), never overwrite it
+                if record == None or record['key'] != key:
+                    print('{}: keeping {} as it was edited by hand, delete it to run the step again'.format(step.name, ', '.join(step.outputs)))
+                self.state['steps'][step.name] = {'key': key, 'outputs': record['outputs'] if record != None else {}}
+                return True
+        if record == None or record['key'] != key:
+            return False
+        return all(self.digest(output) != None and self.digest(output) == record['outputs'].get(output) for output in step.outputs)
+
+    def run_step(self, step):
+        # runs in a thread, the step itself in its own process
+        command = [sys.executable, os.path.join(SCRIPT_DIR, step.script)] + step.options + step.params + step.args
+        start = time.perf_counter()
+        with open(os.path.join(self.dir, step.name+'.log'), 'w') as log:
+            result = subprocess.run(command, cwd=self.dir, stdout=log, stderr=subprocess.STDOUT)
+        return result.returncode, time.perf_counter() - start
+
+    def run(self, jobs=1, force=(), dry_run=False):
+        '''Runs the out of date steps and returns a map step name -> status.'''
+        status = {}
+        deps = {step.name: sorted(set(self.producers[name].name for name in step.inputs if name in self.producers)) for step in self.steps}
+        pending = list(self.steps)
+        running = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+            while len(pending) > 0 or len(running) > 0:
+                for step in list(pending):
+                    waiting = [dep for dep in deps[step.name] if status.get(dep) == None]
+                    if len(waiting) > 0:
+                        continue
+                    if any(cache in other.caches for cache in step.caches for other, _ in running.values()):
+                        # the first one writes the cache, the other reuses it
+                        continue
+                    pending.remove(step)
+                    blocked = [dep for dep in deps[step.name] if status[dep] not in ('current', 'done')]
+                    missing = [name for name in step.inputs if name not in self.producers and self.digest(name) == None]
+                    if len(blocked) > 0 and all(status[dep] == 'stale' for dep in blocked):
+                        # its inputs would change, so it would run as well
+                        status[step.name] = 'stale'
+                        print('{}: would run after {}'.format(step.name, ', '.join(blocked)))
+                        continue
+                    if len(blocked) > 0:
+                        status[step.name] = 'blocked'
+                        print('{}: waiting for {}'.format(step.name, ', '.join(blocked)))
+                        continue
+                    if len(missing) > 0:
+                        status[step.name] = 'missing'
+                        print('{}: skipped, missing {}'.format(step.name, ', '.join(missing)))
+                        continue
+                    key = self.key(step)
+                    if step.name not in force and self.is_current(step, key):
+                        status[step.name] = 'current'
+                        print('{}: up to date'.format(step.name))
+                        continue
+                    if dry_run:
+                        status[step.name] = 'stale'
+                        print('{}: would run'.format(step.name))
+                        continue
+                    print('{}: running'.format(step.name), flush=True)
+                    running[pool.submit(self.run_step, step)] = (step, key)
+                if len(running) == 0:
+                    continue
+                finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    step, key = running.pop(future)
+                    returncode, seconds = future.result()
+                    if returncode != 0:
+                        status[step.name] = 'failed'
+                        print('{}: failed with exit code {} after {:.1f}s, see {}'.format(step.name, returncode, seconds, os.path.join(self.dir, step.name+'.log')))
+                        continue
+                    self.state['steps'][step.name] = {'key': key, 'outputs': {output: self.digest(output) for output in step.outputs}}
+                    self.save()
+                    status[step.name] = 'review' if step.review else 'done'
+                    print('{}: done in {:.1f}s'.format(step.name, seconds), flush=True)
+                    if step.review:
+                        print('Check {} (the first DBLP match of each reviewer must be the right one), then run the pipeline again'.format(', '.join(step.outputs)))
+        if not dry_run:
+            self.save()
+        return status
+
+
+if __name__ == '__main__':
+    timers = instrument.pop_profile(sys.argv)
+    workers = instrument.pop_workers(sys.argv)
+    hops = instrument.parse_number(instrument.pop_option(sys.argv, '--hops', 1))
+    force = instrument.pop_option(sys.argv, '--force', '')
+    flags = {}
+    for flag in ('--index', '--fuzzy', '--dry-run'):
+        flags[flag] = flag in sys.argv
+        if flags[flag]:
+            sys.argv.remove(flag)
+    if len(sys.argv) != 2 or workers < 1 or hops == None or force == None or (hops > 1 and not flags['--index']):
+        print('Run the out of date steps of the pipeline. Run the script with: python3 {} [-j workers] [--index] [--fuzzy] [--hops K (with --index)] [--force step,...] [--dry-run] [--profile timings.json|stats.prof] work-dir'.format(sys.argv[0]))
+        exit(1)
+    start = time.perf_counter()
+    pipeline = Pipeline(sys.argv[1], build_steps(sys.argv[1], workers, flags['--index'], flags['--fuzzy'], hops))
+    with timers.stage('run steps'):
+        status = pipeline.run(workers, force.split(','), flags['--dry-run'])
+    timers.finish()
+    print('Pipeline finished in {:.1f}s: {}'.format(time.perf_counter() - start, ', '.join('{} {}'.format(sum(1 for name in status if status[name] == value), value) for value in sorted(set(status.values())))))
+    if 'failed' in status.values():
+        exit(1)
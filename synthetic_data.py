@@ -0,0 +1,312 @@
+#!/usr/bin/python3
+'''
+The goal of this script is to generate synthetic inputs for testing and benchmarking without the
+real DBLP dump or confidential HotCRP exports. It writes into the output directory:
+- dblp.xml.gz and dblp.dtd: publications, proceedings editors, and person (www) records with
+  ORCIDs, aliases, homonyms ("Jane Doe 0001"), and names that need DTD entities
+- hotcrp-users.csv and hotcrp-users-mapped.csv: the PC and its true DBLP names
+- hotcrp-authors.csv, hotcrp-scores.csv, hotcrp-allprefs.csv: submissions, review assignments with
+  some conflicted reviewers, and all PC preferences including a small bidding ring
+- manifest.csv for compute_bai.py and synthetic.json with the parameters and counts
+Authors belong to research communities and mostly publish, submit, and bid within them, so the
+coauthor graph and the bids have a realistic structure. The same seed gives the same files.
+'''
+import csv
+from datetime import date, timedelta
+import gzip
+import json
+import os
+import random
+import sys
+
+from instrument import parse_number, pop_option
+
+# parameters at scale 1, a mid-sized conference and a small slice of DBLP; --scale multiplies
+# everything but the years. The allprefs export has papers x PC rows.
+DEFAULTS = {'papers': 400, 'pc': 60, 'authors': 20000, 'pubs': 60000, 'years': 10, 'homonyms': 200, 'seed': 1}
+COMMUNITY_SIZE = 50
+ORCID_FRACTION = 0.3    # persons with an ORCID in DBLP
+ALIAS_FRACTION = 0.02   # persons with a second name in their person record
+PC_OWN_COMMUNITY = 0.3  # chance that a review goes to a PC member of the paper's community
+RING_SIZE = 3
+
+GIVEN = ['Anna', 'Ben', 'Chen', 'David', 'Elena', 'Felix', 'Grace', 'Hiro', 'Ines', 'Jan', 'Karim', 'Lena', 'Mei', 'Nils',
+         'Omar', 'Paula', 'Qiang', 'Rosa', 'Sven', 'Tara', 'Uma', 'Victor', 'Wei', 'Xin', 'Yara', 'Zoe', 'José', 'Renée',
+         'Björn', 'Inés']
+FAMILY_PARTS = ['Ander', 'Berg', 'Cruz', 'Dal', 'Eck', 'Fern', 'Gold', 'Hart', 'Ivan', 'Jung', 'Kov', 'Lind', 'Mar', 'Nov',
+                'Ols', 'Pet', 'Quin', 'Ross', 'Sato', 'Tan', 'Ull', 'Vog', 'Wal', 'Xu', 'Yama', 'Zim', 'Mül', 'Góm', 'Jör']
+FAMILY_ENDS = ['', 'son', 'er', 'ez', 'ova', 'mann', 'i', 'sson', 'ato', 'berg', 'ski', 'ler']
+ENTITIES = {'é': 'eacute', 'ö': 'ouml', 'ü': 'uuml', 'ó': 'oacute'}
+PUB_TYPES = [('inproceedings', 55), ('article', 35), ('incollection', 4), ('proceedings', 3), ('phdthesis', 3)]
+
+RECORD_TAGS = ['article', 'inproceedings', 'proceedings', 'book', 'incollection', 'phdthesis', 'mastersthesis', 'www', 'data']
+FIELDS = ['author', 'editor', 'title', 'booktitle', 'journal', 'year', 'url', 'ee', 'school', 'publisher', 'crossref', 'note']
+DTD = ('<!ELEMENT dblp ({})*>\n<!ATTLIST dblp xmlns:xlink CDATA #IMPLIED>\n'.format('|'.join(RECORD_TAGS)) +
+       ''.join('<!ELEMENT {} ({})*>\n<!ATTLIST {} key CDATA #REQUIRED mdate CDATA #IMPLIED>\n'.format(tag, '|'.join(FIELDS), tag) for tag in RECORD_TAGS) +
+       ''.join('<!ELEMENT {} (#PCDATA)>\n'.format(field) for field in FIELDS) +
+       '<!ATTLIST author orcid CDATA #IMPLIED>\n<!ATTLIST editor orcid CDATA #IMPLIED>\n<!ATTLIST note type CDATA #IMPLIED>\n' +
+       ''.join('<!ENTITY {} "&#{};">\n'.format(ENTITIES[c], ord(c)) for c in sorted(ENTITIES)))
+
+class Person():
+    def __init__(self, pid, given, family, dblp, community):
+        self.pid = pid
+        self.given = given
+        self.family = family
+        self.dblp = dblp           # name in DBLP, with a homonym suffix where needed
+        self.community = community
+        self.orcid = ''
+        self.alias = None          # second DBLP name of the same person
+        self.pubs = 0
+        email_name = '{}.{}'.format(given, family).lower().encode('ascii', 'ignore').decode()
+        self.email = '{}{}@inst{}.example.org'.format(email_name, pid, community)
+        self.affiliation = 'Institute {}'.format(community)
+
+def orcid_checksum(digits):
+    # ISO 7064 11,2 as used by ORCID
+    total = 0
+    for digit in digits:
+        total = (total + int(digit)) * 2
+    check = (12 - total % 11) % 11
+    return 'X' if check == 10 else str(check)
+
+def make_orcid(rng):
+    digits = '000{:012d}'.format(rng.randrange(10**12))
+    digits = digits[:15]
+    digits += orcid_checksum(digits)
+    return '-'.join(digits[i:i+4] for i in range(0, 16, 4))
+
+def xml_text(text):
+    text = text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    return ''.join('&{};'.format(ENTITIES[c]) if c in ENTITIES else c for c in text)
+
+def make_persons(rng, params):
+    persons = []
+    seen = set()
+    # homonyms: base names shared by two or three persons, all of them carry a DBLP suffix
+    homonym_names = []
+    while len(homonym_names) < params['homonyms']:
+        name = (rng.choice(GIVEN), rng.choice(FAMILY_PARTS) + rng.choice(FAMILY_ENDS))
+        if name not in seen:
+            seen.add(name)
+            homonym_names.append(name)
+    nr_communities = max(1, params['authors'] // COMMUNITY_SIZE)
+    for given, family in homonym_names:
+        for suffix in range(1, rng.choice((2, 2, 3)) + 1):
+            if len(persons) < params['authors']:
+                persons.append(Person(len(persons), given, family, '{} {} {:04d}'.format(given, family, suffix), rng.randrange(nr_communities)))
+    while len(persons) < params['authors']:
+        given, family = rng.choice(GIVEN), rng.choice(FAMILY_PARTS) + rng.choice(FAMILY_ENDS)
+        if (given, family) in seen:
+            # unique names with a middle initial
+            given = '{} {}.'.format(given, chr(ord('A') + rng.randrange(26)))
+            if (given, family) in seen:
+                continue
+        seen.add((given, family))
+        persons.append(Person(len(persons), given, family, '{} {}'.format(given, family), rng.randrange(nr_communities)))
+    for person in persons:
+        if rng.random() < ORCID_FRACTION:
+            person.orcid = make_orcid(rng)
+        if rng.random() < ALIAS_FRACTION:
+            person.alias = '{}. {}'.format(person.given[0], person.family)
+    communities = [[] for i in range(nr_communities)]
+    for person in persons:
+        communities[person.community].append(person)
+    return persons, [community for community in communities if len(community) > 0]
+
+def pick_authors(rng, communities, weights, count):
+    # mostly from one community, productive members more often, sometimes one outside collaborator
+    community = rng.choice(communities)
+    cum_weights = weights[len(community)]
+    authors = []
+    for i in rng.choices(range(len(community)), cum_weights=cum_weights, k=count):
+        if community[i] not in authors:
+            authors.append(community[i])
+    if rng.random() < 0.1:
+        outsider = rng.choice(rng.choice(communities))
+        if outsider not in authors:
+            authors.append(outsider)
+    return authors
+
+def community_weights(communities):
+    # Zipf-like productivity within a community: cumulative weights per community size
+    weights = {}
+    for community in communities:
+        if len(community) not in weights:
+            total = 0
+            cumulative = []
+            for rank in range(len(community)):
+                total += 1/(rank+1)
+                cumulative.append(total)
+            weights[len(community)] = cumulative
+    return weights
+
+def author_tag(rng, tag, person):
+    name = person.alias if person.alias != None and rng.random() < 0.2 else person.dblp
+    if person.orcid != '' and rng.random() < 0.5:
+        return '<{} orcid="{}">{}</{}>\n'.format(tag, person.orcid, xml_text(name), tag)
+    return '<{}>{}</{}>\n'.format(tag, xml_text(name), tag)
+
+def write_dblp(rng, params, persons, communities, out_dir):
+    with open(os.path.join(out_dir, 'dblp.dtd'), 'w', encoding='ISO-8859-1') as f:
+        f.write(DTD)
+    current_year = date.today().year
+    first_year = current_year - params['years'] + 1
+    first_mdate = date(first_year, 1, 1)
+    mdate_days = (date.today() - first_mdate).days
+    weights = community_weights(communities)
+    tags = [tag for tag, share in PUB_TYPES]
+    shares = [share for tag, share in PUB_TYPES]
+    with gzip.open(os.path.join(out_dir, 'dblp.xml.gz'), 'wt', encoding='ISO-8859-1', compresslevel=6) as f:
+        f.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n<!DOCTYPE dblp SYSTEM "dblp.dtd">\n<dblp>\n')
+        # person records, with ORCIDs and aliases
+        for person in persons:
+            if person.orcid == '' and person.alias == None and not person.dblp[-4:].isdigit():
+                continue
+            mdate = first_mdate + timedelta(days=rng.randrange(mdate_days+1))
+            record = '<www mdate="{}" key="homepages/{}/{}">\n'.format(mdate, person.community, person.pid)
+            record += '<author>{}</author>\n'.format(xml_text(person.dblp))
+            if person.alias != None:
+                record += '<author>{}</author>\n'.format(xml_text(person.alias))
+            record += '<title>Home Page</title>\n'
+            if person.orcid != '':
+                record += '<url>https://orcid.org/{}</url>\n'.format(person.orcid)
+            if person.dblp[-4:].isdigit():
+                record += '<note type="affiliation">{}</note>\n'.format(person.affiliation)
+            f.write(record + '</www>\n')
+        for i in range(params['pubs']):
+            tag = rng.choices(tags, weights=shares)[0]
+            year = rng.randint(first_year, current_year)
+            mdate = first_mdate + timedelta(days=rng.randrange(mdate_days+1))
+            authors = pick_authors(rng, communities, weights, 1 if tag == 'phdthesis' else rng.choice((1, 2, 2, 3, 3, 3, 4, 4, 5, 6)))
+            record = '<{} mdate="{}" key="{}/v{}/{}">\n'.format(tag, mdate, tag, authors[0].community, i)
+            for person in authors:
+                record += author_tag(rng, 'editor' if tag == 'proceedings' else 'author', person)
+                person.pubs += 1
+            record += '<title>Synthetic {} number {}.</title>\n'.format(tag, i)
+            if tag == 'article':
+                record += '<journal>J. Synth. {}</journal>\n'.format(authors[0].community)
+            elif tag == 'phdthesis':
+                record += '<school>{}</school>\n'.format(authors[0].affiliation)
+            else:
+                record += '<booktitle>SYN {}</booktitle>\n'.format(authors[0].community)
+            record += '<year>{}</year>\n'.format(year)
+            f.write(record + '</{}>\n'.format(tag))
+        f.write('</dblp>\n')
+
+def write_hotcrp(rng, params, persons, communities, out_dir):
+    # PC members are established researchers, drawn from the most productive authors
+    active = sorted((person for person in persons if person.pubs > 0), key=lambda person: -person.pubs)
+    pc = rng.sample(active[:params['pc']*5], min(params['pc'], len(active)))
+    pc_by_community = {}
+    for member in pc:
+        pc_by_community.setdefault(member.community, []).append(member)
+    with open(os.path.join(out_dir, 'hotcrp-users.csv'), 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['given_name', 'family_name', 'email', 'affiliation', 'country', 'orcid'])
+        for member in pc:
+            writer.writerow([member.given, member.family, member.email, member.affiliation, 'CH', member.orcid if rng.random() < 0.7 else ''])
+    with open(os.path.join(out_dir, 'hotcrp-users-mapped.csv'), 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f)
+        for member in pc:
+            writer.writerow(['{} {}'.format(member.given, member.family), member.email, member.orcid, member.dblp] + ([member.alias] if member.alias != None else []))
+
+    # submissions, a fifth of the PC also submits
+    weights = community_weights(communities)
+    submitting_pc = rng.sample(pc, len(pc)//5)
+    papers = []
+    for i in range(params['papers']):
+        authors = pick_authors(rng, communities, weights, rng.choice((1, 2, 3, 3, 4, 4, 5)))
+        if rng.random() < 0.2 and len(submitting_pc) > 0:
+            member = rng.choice(submitting_pc)
+            if member not in authors:
+                authors.append(member)
+        papers.append((str(i+1), 'Synthetic submission {}'.format(i+1), authors))
+    # a bidding ring: PC members that each have a submission and bid on each other's papers
+    ring = submitting_pc[:RING_SIZE]
+    for member in ring:
+        paper_id, title, authors = rng.choice(papers)
+        if member not in authors:
+            authors.append(member)
+
+    with open(os.path.join(out_dir, 'hotcrp-authors.csv'), 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['paper', 'title', 'first', 'last', 'email', 'affiliation'])
+        for paper_id, title, authors in papers:
+            for person in authors:
+                writer.writerow([paper_id, title, person.given, person.family, person.email, person.affiliation])
+
+    with open(os.path.join(out_dir, 'hotcrp-scores.csv'), 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['paper', 'title', 'decision', 'review', 'reviewername', 'email'])
+        for paper_id, title, authors in papers:
+            reviewers = []
+            while len(reviewers) < min(3, len(pc)):
+                nearby = pc_by_community.get(authors[0].community, ())
+                # reviewers from the paper's community are likely conflicted
+                member = rng.choice(nearby) if len(nearby) > 0 and rng.random() < PC_OWN_COMMUNITY else rng.choice(pc)
+                if member not in reviewers and member not in authors:
+                    reviewers.append(member)
+                elif len(pc) <= len(authors) + len(reviewers):
+                    break
+            for letter, member in zip('ABC', reviewers):
+                writer.writerow([paper_id, title, '', letter, '{} {}'.format(member.given, member.family), member.email])
+
+    with open(os.path.join(out_dir, 'hotcrp-allprefs.csv'), 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['paper', 'title', 'given_name', 'family_name', 'email', 'affiliation', 'preference', 'topic_score'])
+        ring_emails = set(member.email for member in ring)
+        for paper_id, title, authors in papers:
+            community = authors[0].community
+            in_ring = set(person.email for person in authors) & ring_emails
+            for member in pc:
+                if member.email in ring_emails and len(in_ring - {member.email}) > 0:
+                    preference = 20
+                elif member.community == community and rng.random() < 0.5:
+                    preference = rng.choice((5, 10, 10, 20))
+                elif rng.random() < 0.1:
+                    preference = rng.choice((-20, -10, 1, 2, 5))
+                else:
+                    preference = rng.choice(('', 0, 0))
+                topic_score = rng.choice(('', 0, 1, 2, -1)) if member.community != community else rng.choice((2, 3, 4))
+                writer.writerow([paper_id, title, member.given, member.family, member.email, member.affiliation, preference, topic_score])
+
+    with open(os.path.join(out_dir, 'manifest.csv'), 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['conference', 'year', 'cycle', 'authors', 'allprefs'])
+        writer.writerow(['SYN', date.today().year, 'all', 'hotcrp-authors.csv', 'hotcrp-allprefs.csv'])
+    return pc, papers, ring
+
+def generate(out_dir, params):
+    rng = random.Random(params['seed'])
+    os.makedirs(out_dir, exist_ok=True)
+    persons, communities = make_persons(rng, params)
+    write_dblp(rng, params, persons, communities, out_dir)
+    pc, papers, ring = write_hotcrp(rng, params, persons, communities, out_dir)
+    summary = {'params': params, 'persons': len(persons), 'communities': len(communities),
+               'submission_authors': sum(len(authors) for paper_id, title, authors in papers),
+               'allprefs_rows': len(papers)*len(pc), 'ring': [member.email for member in ring]}
+    with open(os.path.join(out_dir, 'synthetic.json'), 'w') as f:
+        json.dump(summary, f, indent=1)
+    return summary
+
+def scaled_params(argv):
+    # --scale first, then explicit values override; None if a value is missing or not a number
+    scale = parse_number(pop_option(argv, '--scale', 1), float, 0)
+    if scale == None:
+        return None
+    params = {}
+    for name in DEFAULTS:
+        value = DEFAULTS[name] if name in ('years', 'seed') else max(1, int(DEFAULTS[name]*scale))
+        params[name] = parse_number(pop_option(argv, '--'+name, value), int, 0)
+        if params[name] == None:
+            return None
+    return params
+
+
+if __name__ == '__main__':
+    params = scaled_params(sys.argv)
+    if len(sys.argv) != 2 or params == None:
+        print('Generate synthetic DBLP and HotCRP data. Run the script with: python3 {} [--scale K] [--papers N] [--pc N] [--authors N] [--pubs N] [--years N] [--homonyms N] [--seed S] output-dir'.format(sys.argv[0]))
+        exit(1)
+    summary = generate(sys.argv[1], params)
+    print('Generated {} DBLP persons, {} publications, {} submissions, and {} allprefs rows into {}'.format(summary['persons'], params['pubs'], params['papers'], summary['allprefs_rows'], sys.argv[1]))
@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+'''
+Bounded-depth transitive conflicts: authors that never wrote a paper with a reviewer but are
+close in the coauthor graph, e.g. the other coauthors of the reviewer's student (2 hops).
+
+The coauthor graph of the recent DBLP window is precomputed from the DBLP index as a sparse
+author x author matrix weighted by the number of shared papers and cached next to the index.
+All reviewers are expanded at once with sparse matrix products; the weight of an author k hops
+away is the number of shared-paper paths from the reviewer.
+'''
+import hashlib
+import json
+import os
+
+import numpy as np
+import scipy.sparse as sp
+
+MAX_PUB_AUTHORS = 50 # papers with more authors say little about who works together
+MIN_WEIGHT = 2 # minimum number of shared-paper paths for an indirect conflict
+
+def window_adjacency(index, current_year):
+    # the cache is keyed by the build of the index, author ids change when the index is rebuilt
+    build = hashlib.sha1(json.dumps(index.meta, sort_keys=True).encode('utf8')).hexdigest()[:12]
+    cache = os.path.join(index.path, 'adjacency-{}-{}.npz'.format(current_year, build))
+    if os.path.exists(cache):
+        adjacency = sp.load_npz(cache)
+        if adjacency.shape == (len(index.names), len(index.names)):
+            return adjacency
+    years = np.frombuffer(index.pub_year, dtype=np.uint16)
+    ptr = np.frombuffer(index.pub_ptr, dtype=np.uint32).astype(np.int64)
+    authors = np.frombuffer(index.pub_authors, dtype=np.uint32).astype(np.int64)
+    incidence = sp.csr_matrix((np.ones(len(authors), dtype=np.int32), authors, ptr), shape=(len(years), len(index.names)))
+    sizes = np.diff(ptr)
+    keep = np.flatnonzero((years >= current_year - 5) & (years <= current_year) & (sizes <= MAX_PUB_AUTHORS))
+    incidence = incidence[keep]
+    incidence.sum_duplicates()
+    incidence.data[:] = 1
+    adjacency = (incidence.T @ incidence).tocsr()
+    adjacency.setdiag(0)
+    adjacency.eliminate_zeros()
+    # written under a temporary name first, readers never see a partial file
+    partial = '{}.{}.tmp.npz'.format(cache[:-4], os.getpid())
+    sp.save_npz(partial, adjacency)
+    os.replace(partial, cache)
+    return adjacency
+
+def khop_conflicts(adjacency, sources, targets, hops, min_weight=MIN_WEIGHT):
+    '''Expand all sources at once for up to hops steps and return
+    (source position, target id, hops, weight, via id) for every target that is 2 or more hops away,
+    via is the strongest neighbor on the last hop. Each source is a list of author ids, all names of
+    one person.'''
+    targets = np.array(sorted(set(targets)), dtype=np.int64)
+    n = adjacency.shape[0]
+    rows = np.repeat(np.arange(len(sources)), [len(ids) for ids in sources])
+    ids = np.array([aid for ids in sources for aid in ids], dtype=np.int64)
+    frontier = sp.csr_matrix((np.ones(len(ids), dtype=np.int64), (rows, ids)), shape=(len(sources), n))
+    reached = frontier.copy()
+    to_targets = adjacency[:, targets].tocsc()
+    conflicts = []
+    for hop in range(1, hops+1):
+        if hop >= 2 and len(targets) > 0:
+            # targets first reached in this hop over enough paths
+            hits = (frontier @ to_targets).tocsr()
+            hits = hits - hits.multiply(reached[:, targets] != 0)
+            hits.data[hits.data < min_weight] = 0
+            hits.eliminate_zeros()
+            hits = hits.tocoo()
+            # paths over each neighbor, one row per hit, the strongest neighbor is via
+            paths = frontier[hits.row].multiply(to_targets[:, hits.col].T).tocsr()
+            via = np.asarray(paths.argmax(axis=1)).ravel()
+            conflicts.extend(zip(hits.row.tolist(), targets[hits.col].tolist(), [hop]*len(via), hits.data.tolist(), via.tolist()))
+        if hop == hops:
+            break
+        frontier = frontier @ adjacency
+        # only keep authors first reached in this hop, and prune weak links beyond direct coauthors
+        frontier = frontier - frontier.multiply(reached)
+        if hop >= 2:
+            frontier.data[frontier.data < min_weight] = 0
+        frontier.eliminate_zeros()
+        reached = reached + (frontier != 0).astype(np.int64)
+    return conflicts